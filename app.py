@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
 import base64
+import contextvars
+import functools
+import hashlib
+import io
+import itertools
 import json
 import os
+import queue
+import shutil
+import signal
+import socket
+import struct
+import sys
+import tempfile
 import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
-from urllib.parse import quote
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, Optional, Union
+from urllib.parse import quote, urljoin
 
 import requests
-from flask import Flask, jsonify, request
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, jsonify, request
+
+import pdf_engine
+import tracing
+from input_cache import InputCache, MappedInputs
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from result_cache import ResultCache
+from sku_mapping import (MAPPING_REF_PATTERN, MappingStore, SkuMapping, cache_info as mapping_cache_info,
+                         compile_mapping, local_versions)
+from sku_match import FUZZY_MAX_DISTANCE, FUZZY_MIN_LENGTH
 
 app = Flask(__name__)
 
@@ -17,6 +41,8 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL", "").rstrip("/")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
 PDF_ORGANIZER_BUCKET = os.environ.get("PDF_ORGANIZER_BUCKET", "supplier-return-labels")
 PROCESSOR_URL = os.environ.get("PDF_ORGANIZER_PROCESSOR_URL", "").strip()
+# "remote" posts to PDF_ORGANIZER_PROCESSOR_URL; "local" organizes in-process via pdf_engine.
+ENGINE = os.environ.get("PDF_ORGANIZER_ENGINE", "remote").strip().lower()
 PROCESSOR_SECRET = os.environ.get("PDF_ORGANIZER_PROCESSOR_SECRET", "").strip()
 WORKER_SECRET = os.environ.get("PDF_ORGANIZER_WORKER_SECRET", "").strip()
 HEARTBEAT_SECONDS = int(os.environ.get("PDF_ORGANIZER_WORKER_HEARTBEAT_SECONDS", "20"))
@@ -24,6 +50,60 @@ MAX_ATTEMPTS = int(os.environ.get("PDF_ORGANIZER_MAX_ATTEMPTS", "3"))
 BASE_BACKOFF_SECONDS = int(os.environ.get("PDF_ORGANIZER_BASE_BACKOFF_SECONDS", "30"))
 PROCESSOR_TIMEOUT_SECONDS = int(os.environ.get("PDF_ORGANIZER_PROCESSOR_TIMEOUT_SECONDS", "900"))
 PROCESSOR_ATTEMPTS = max(1, int(os.environ.get("PDF_ORGANIZER_PROCESSOR_ATTEMPTS", "3")))
+JOB_CONCURRENCY = max(1, int(os.environ.get("PDF_ORGANIZER_WORKER_CONCURRENCY", "4")))
+JOB_QUEUE_SIZE = max(0, int(os.environ.get("PDF_ORGANIZER_WORKER_QUEUE_SIZE", "16")))
+QUEUE_FULL_RETRY_AFTER_SECONDS = max(1, int(os.environ.get("PDF_ORGANIZER_QUEUE_FULL_RETRY_AFTER_SECONDS", "30")))
+IO_THREADS = max(1, int(os.environ.get("PDF_ORGANIZER_IO_THREADS", str(JOB_CONCURRENCY * 2))))
+SPOOL_MAX_MEMORY_BYTES = int(os.environ.get("PDF_ORGANIZER_SPOOL_MAX_MEMORY_BYTES", str(8 * 1024 * 1024)))
+STREAM_CHUNK_BYTES = 1024 * 1024
+UPLOAD_TIMEOUT_SECONDS = int(os.environ.get("PDF_ORGANIZER_UPLOAD_TIMEOUT_SECONDS", "120"))
+# Supabase's resumable endpoint requires 6 MiB chunks (only the last may be shorter).
+RESUMABLE_THRESHOLD_BYTES = int(os.environ.get("PDF_ORGANIZER_RESUMABLE_THRESHOLD_BYTES", str(6 * 1024 * 1024)))
+RESUMABLE_CHUNK_BYTES = int(os.environ.get("PDF_ORGANIZER_RESUMABLE_CHUNK_BYTES", str(6 * 1024 * 1024)))
+RESUMABLE_CHUNK_ATTEMPTS = max(1, int(os.environ.get("PDF_ORGANIZER_RESUMABLE_CHUNK_ATTEMPTS", "5")))
+PROCESSOR_FRAMES_CONTENT_TYPE = "application/x-pdf-organizer-frames"
+PROCESSOR_OUTPUT_KEYS = ("labelsPdf", "checklistPdf")
+POLL_SECONDS = max(0.1, float(os.environ.get("PDF_ORGANIZER_POLL_SECONDS", "2")))
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get("PDF_ORGANIZER_DRAIN_TIMEOUT_SECONDS", "540"))
+INPUT_CACHE_DIR = os.environ.get("PDF_ORGANIZER_INPUT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "pdf-organizer-inputs")
+INPUT_CACHE_MAX_BYTES = int(os.environ.get("PDF_ORGANIZER_INPUT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("PDF_ORGANIZER_RESULT_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+# Named mapping sets are read from this directory when set, otherwise from Supabase.
+MAPPING_DIR = os.environ.get("PDF_ORGANIZER_MAPPING_DIR", "").strip()
+JOB_REGISTRY_TTL_SECONDS = int(os.environ.get("PDF_ORGANIZER_JOB_REGISTRY_TTL_SECONDS", "900"))
+HTTP_POOL_CONNECTIONS = max(1, int(os.environ.get("PDF_ORGANIZER_HTTP_POOL_CONNECTIONS", "4")))
+# Enough connections per host for every io_pool thread, every job thread and the heartbeat.
+HTTP_POOL_MAXSIZE = max(1, int(os.environ.get("PDF_ORGANIZER_HTTP_POOL_MAXSIZE", str(IO_THREADS + JOB_CONCURRENCY + 1))))
+
+# One adapter (and so one urllib3 pool per host) shared by every thread. Sessions
+# themselves are kept per thread because requests.Session is not thread-safe.
+_http_adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+_http_local = threading.local()
+
+# Shared pool for blocking storage I/O that a job fans out (e.g. the two output uploads).
+io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+input_cache = InputCache(INPUT_CACHE_DIR, INPUT_CACHE_MAX_BYTES)
+
+
+def submit_io(fn: Callable[..., Any], *args: Any) -> "Future[Any]":
+    # Runs fn on io_pool inside a copy of the caller's context, so its spans are
+    # children of the job's span instead of new root traces.
+    return io_pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram("pdf_organizer_job_stage_seconds", "Time spent in each stage of process_job.",
+                                  ("stage",))
+processor_retries = metrics.counter("pdf_organizer_processor_retries_total", "Processor attempts after the first.")
+mark_retry_calls = metrics.counter("pdf_organizer_mark_retry_calls_total", "Calls to mark_pdf_organizer_job_retry.")
+heartbeat_failures = metrics.counter("pdf_organizer_heartbeat_failures_total", "Heartbeat PATCH batches that failed.")
+jobs_finished = metrics.counter("pdf_organizer_jobs_total", "Jobs finished, by outcome.", ("outcome",))
+metrics.gauge("pdf_organizer_jobs_in_flight", "Jobs currently running.", lambda: job_executor.snapshot()["activeSlots"])
+metrics.gauge("pdf_organizer_job_queue_depth", "Accepted jobs waiting for a slot.",
+              lambda: job_executor.snapshot()["queueDepth"])
+metrics.gauge("pdf_organizer_threads", "Live threads in this process.", threading.active_count)
 
 
 def utc_now_iso() -> str:
@@ -37,63 +117,547 @@ def supabase_headers() -> Dict[str, str]:
     }
 
 
+def http_session() -> requests.Session:
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", _http_adapter)
+        session.mount("http://", _http_adapter)
+        _http_local.session = session
+    return session
+
+
 def ensure_env() -> Optional[str]:
     if not SUPABASE_URL:
         return "SUPABASE_URL is missing"
     if not SUPABASE_SERVICE_ROLE_KEY:
         return "SUPABASE_SERVICE_ROLE_KEY is missing"
-    if not PROCESSOR_URL:
+    if ENGINE not in ("remote", "local"):
+        return f"PDF_ORGANIZER_ENGINE must be remote or local, got {ENGINE!r}"
+    if ENGINE == "remote" and not PROCESSOR_URL:
         return "PDF_ORGANIZER_PROCESSOR_URL is missing"
     return None
 
 
 def update_job(job_id: str, payload: Dict[str, Any]) -> None:
-    url = f"{SUPABASE_URL}/rest/v1/pdf_organizer_jobs?id=eq.{quote(job_id, safe='')}"
+    with tracing.span("update_job", job_id=job_id, status=payload.get("status")):
+        patch_jobs(f"id=eq.{quote(job_id, safe='')}", payload)
+
+
+def patch_jobs(filters: str, payload: Dict[str, Any]) -> None:
+    url = f"{SUPABASE_URL}/rest/v1/pdf_organizer_jobs?{filters}"
     headers = supabase_headers()
     headers["Content-Type"] = "application/json"
     headers["Prefer"] = "return=minimal"
-    r = requests.patch(url, headers=headers, data=json.dumps(payload), timeout=20)
+    r = http_session().patch(url, headers=headers, data=json.dumps(payload), timeout=20)
     if r.status_code >= 300:
         raise RuntimeError(f"update_job failed {r.status_code}: {r.text[:500]}")
 
 
 def mark_retry(job_id: str, msg: str, code: str) -> None:
-    url = f"{SUPABASE_URL}/rest/v1/rpc/mark_pdf_organizer_job_retry"
+    with tracing.span("mark_retry", job_id=job_id, error_code=code):
+        mark_retry_calls.inc()
+        url = f"{SUPABASE_URL}/rest/v1/rpc/mark_pdf_organizer_job_retry"
+        headers = supabase_headers()
+        headers["Content-Type"] = "application/json"
+        payload = {
+            "p_job_id": job_id,
+            "p_error_message": msg,
+            "p_error_code": code,
+            "p_max_attempts": MAX_ATTEMPTS,
+            "p_base_backoff_seconds": BASE_BACKOFF_SECONDS,
+        }
+        r = http_session().post(url, headers=headers, data=json.dumps(payload), timeout=20)
+        if r.status_code >= 300:
+            raise RuntimeError(f"mark_retry failed {r.status_code}: {r.text[:500]}")
+
+
+def object_url(path: str) -> str:
+    return f"{SUPABASE_URL}/storage/v1/object/{PDF_ORGANIZER_BUCKET}/{quote(path, safe='/')}"
+
+
+def object_etag(path: str) -> Optional[str]:
+    r = http_session().head(object_url(path), headers=supabase_headers(), timeout=20)
+    if r.status_code >= 300:
+        raise RuntimeError(f"object_etag failed {r.status_code}")
+    return r.headers.get("ETag")
+
+
+def download_object(path: str, dest: str) -> Optional[str]:
+    with http_session().get(object_url(path), headers=supabase_headers(), stream=True, timeout=UPLOAD_TIMEOUT_SECONDS) as r:
+        if r.status_code >= 300:
+            raise RuntimeError(f"download_object failed {r.status_code}: {r.text[:500]}")
+        with open(dest, "wb") as f:
+            for chunk in r.iter_content(STREAM_CHUNK_BYTES):
+                f.write(chunk)
+        return r.headers.get("ETag")
+
+
+def fetch_mapping_versions(mapping_id: str, after_version: int, up_to_version: int) -> list[tuple[int, str]]:
+    url = (f"{SUPABASE_URL}/rest/v1/pdf_organizer_sku_mappings?select=version,csv_data"
+           f"&mapping_id=eq.{quote(mapping_id, safe='')}&version=gt.{after_version}&version=lte.{up_to_version}"
+           f"&order=version.asc")
+    r = http_session().get(url, headers=supabase_headers(), timeout=60)
+    if r.status_code >= 300:
+        raise RuntimeError(f"fetch_mapping_versions failed {r.status_code}: {r.text[:500]}")
+    return [(int(row["version"]), row.get("csv_data") or "") for row in r.json()]
+
+
+mapping_store = MappingStore(local_versions(MAPPING_DIR) if MAPPING_DIR else fetch_mapping_versions)
+
+
+def copy_object(source: str, destination: str) -> None:
     headers = supabase_headers()
     headers["Content-Type"] = "application/json"
-    payload = {
-        "p_job_id": job_id,
-        "p_error_message": msg,
-        "p_error_code": code,
-        "p_max_attempts": MAX_ATTEMPTS,
-        "p_base_backoff_seconds": BASE_BACKOFF_SECONDS,
-    }
-    r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=20)
+    headers["x-upsert"] = "true"
+    payload = {"bucketId": PDF_ORGANIZER_BUCKET, "sourceKey": source, "destinationKey": destination}
+    r = http_session().post(f"{SUPABASE_URL}/storage/v1/object/copy", headers=headers, data=json.dumps(payload), timeout=60)
     if r.status_code >= 300:
-        raise RuntimeError(f"mark_retry failed {r.status_code}: {r.text[:500]}")
+        raise RuntimeError(f"copy_object failed {r.status_code}: {r.text[:500]}")
+
+
+def fetch_input(path: str, dest: str, etag: Optional[str] = None) -> None:
+    if input_cache.enabled:
+        if etag is None:
+            try:
+                etag = object_etag(path)
+            except Exception as e:
+                print(f"[inputs] etag lookup failed for {path}: {e}")
+        if etag and input_cache.fetch(path, etag, dest):
+            return
+    etag = download_object(path, dest) or etag
+    if etag:
+        input_cache.store(path, etag, dest)
+
+
+def fetch_inputs(pairs: list[tuple[str, str]], etags: Optional[Dict[str, str]] = None) -> None:
+    etags = etags or {}
+    futures = [submit_io(fetch_input, path, dest, etags.get(path)) for path, dest in pairs]
+    wait(futures)
+    for f in futures:
+        f.result()
+
+
+UploadContent = Union[bytes, bytearray, IO[bytes], Iterable[bytes]]
+
+
+def content_length(content: UploadContent) -> Optional[int]:
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    if hasattr(content, "seek") and hasattr(content, "tell"):
+        try:
+            pos = content.tell()
+            end = content.seek(0, io.SEEK_END)
+            content.seek(pos)
+            return end - pos
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+def iter_upload_chunks(content: UploadContent, chunk_size: int) -> Iterator[bytes]:
+    if isinstance(content, (bytes, bytearray)):
+        for i in range(0, len(content), chunk_size):
+            yield bytes(content[i:i + chunk_size])
+        return
+    if hasattr(content, "read"):
+        source: Iterable[bytes] = iter(lambda: content.read(STREAM_CHUNK_BYTES), b"")
+    else:
+        source = content
+    buf = bytearray()
+    for piece in source:
+        buf += piece
+        while len(buf) >= chunk_size:
+            yield bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+    if buf:
+        yield bytes(buf)
+
+
+class ChunkPipe:
+    # Bounded hand-off from a thread writing a document to a thread uploading it. The
+    # writer blocks once max_chunks are waiting, so at most that much of the document
+    # is ever held in memory. Used as a context manager by the writer: a clean exit ends
+    # the stream, an exception is passed on to the reader instead of an end-of-stream.
+    def __init__(self, chunk_size: int = STREAM_CHUNK_BYTES, max_chunks: int = 4) -> None:
+        self.chunk_size = chunk_size
+        self.bytes_written = 0
+        self._buf = bytearray()
+        self._queue: "queue.Queue[Union[bytes, BaseException, None]]" = queue.Queue(maxsize=max_chunks)
+        self._abandoned = threading.Event()
+
+    def write(self, data: bytes) -> int:
+        self._buf += data
+        self.bytes_written += len(data)
+        while len(self._buf) >= self.chunk_size:
+            self._put(bytes(self._buf[:self.chunk_size]))
+            del self._buf[:self.chunk_size]
+        return len(data)
 
+    def _put(self, item: Union[bytes, BaseException, None]) -> None:
+        while not self._abandoned.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        if item is not None and not isinstance(item, BaseException):
+            raise RuntimeError("stream reader went away")
+
+    def close(self) -> None:
+        if self._buf:
+            self._put(bytes(self._buf))
+            self._buf.clear()
+        self._put(None)
+
+    def fail(self, exc: BaseException) -> None:
+        self._buf.clear()
+        self._put(exc)
+
+    def abandon(self) -> None:
+        # Called by the reader when it stops early so a blocked writer fails instead of hanging.
+        self._abandoned.set()
+
+    def __enter__(self) -> "ChunkPipe":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        if exc is None:
+            self.close()
+        else:
+            self.fail(exc)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise RuntimeError(f"stream writer failed: {item}")
+            yield item
+
+
+def upload_pdf(path: str, content: UploadContent) -> None:
+    with tracing.span("upload_pdf", path=path):
+        size = content_length(content)
+        if size is None:
+            # A stream that ends within the threshold still goes up as one plain upload.
+            chunks = iter_upload_chunks(content, RESUMABLE_CHUNK_BYTES)
+            head = bytearray()
+            for chunk in chunks:
+                head += chunk
+                if len(head) > RESUMABLE_THRESHOLD_BYTES:
+                    upload_resumable(path, iter_upload_chunks(itertools.chain([bytes(head)], chunks),
+                                                              RESUMABLE_CHUNK_BYTES), None)
+                    return
+            content, size = bytes(head), len(head)
+        if size > RESUMABLE_THRESHOLD_BYTES:
+            upload_resumable(path, iter_upload_chunks(content, RESUMABLE_CHUNK_BYTES), size)
+            return
+        if not isinstance(content, (bytes, bytearray)):
+            content = content.read()
+        safe_path = quote(path, safe="/")
+        url = f"{SUPABASE_URL}/storage/v1/object/{PDF_ORGANIZER_BUCKET}/{safe_path}"
+        headers = supabase_headers()
+        headers["Content-Type"] = "application/pdf"
+        headers["x-upsert"] = "true"
+        r = http_session().post(url, headers=headers, data=content, timeout=UPLOAD_TIMEOUT_SECONDS)
+        if r.status_code >= 300:
+            raise RuntimeError(f"upload_pdf failed {r.status_code}: {r.text[:500]}")
+
+
+def timed_upload(path: str, content: UploadContent) -> Dict[str, Any]:
+    size = content_length(content)
+    started = time.monotonic()
+    with stage_seconds.time(stage=f"upload_{os.path.splitext(os.path.basename(path))[0]}"):
+        upload_pdf(path, content)
+    elapsed = time.monotonic() - started
+    if size is None:
+        size = getattr(content, "bytes_written", None)
+    return {"path": path, "bytes": size, "seconds": round(elapsed, 3),
+            "bytesPerSecond": round(size / elapsed) if size is not None and elapsed > 0 else None}
 
-def upload_pdf(path: str, content: bytes) -> None:
-    safe_path = quote(path, safe="/")
-    url = f"{SUPABASE_URL}/storage/v1/object/{PDF_ORGANIZER_BUCKET}/{safe_path}"
+
+def stream_upload(path: str, pipe: ChunkPipe) -> Dict[str, Any]:
+    try:
+        return timed_upload(path, pipe)
+    finally:
+        pipe.abandon()
+
+
+def collect_uploads(uploads: Dict[str, Any], started: float) -> Dict[str, Any]:
+    wait(uploads.values())
+    upload_stats: Dict[str, Any] = {name: f.result() for name, f in uploads.items()}
+    upload_stats["wallSeconds"] = round(time.monotonic() - started, 3)
+    return upload_stats
+
+
+def tus_headers() -> Dict[str, str]:
     headers = supabase_headers()
-    headers["Content-Type"] = "application/pdf"
+    headers["Tus-Resumable"] = "1.0.0"
+    return headers
+
+
+def create_resumable_upload(path: str, size: Optional[int]) -> str:
+    metadata = {"bucketName": PDF_ORGANIZER_BUCKET, "objectName": path, "contentType": "application/pdf"}
+    headers = tus_headers()
     headers["x-upsert"] = "true"
-    r = requests.post(url, headers=headers, data=content, timeout=120)
-    if r.status_code >= 300:
-        raise RuntimeError(f"upload_pdf failed {r.status_code}: {r.text[:500]}")
+    headers["Upload-Metadata"] = ",".join(
+        f"{k} {base64.b64encode(v.encode('utf-8')).decode('ascii')}" for k, v in metadata.items()
+    )
+    if size is None:
+        headers["Upload-Defer-Length"] = "1"
+    else:
+        headers["Upload-Length"] = str(size)
+    endpoint = f"{SUPABASE_URL}/storage/v1/upload/resumable"
+    r = http_session().post(endpoint, headers=headers, timeout=20)
+    if r.status_code >= 300 or not r.headers.get("Location"):
+        raise RuntimeError(f"create_resumable_upload failed {r.status_code}: {r.text[:500]}")
+    return urljoin(endpoint, r.headers["Location"])
+
 
+def resumable_offset(upload_url: str) -> int:
+    r = http_session().head(upload_url, headers=tus_headers(), timeout=20)
+    if r.status_code >= 300 or r.headers.get("Upload-Offset") is None:
+        raise RuntimeError(f"resumable_offset failed {r.status_code}")
+    return int(r.headers["Upload-Offset"])
 
-def heartbeat_loop(job_id: str, worker_id: str, stop_event: threading.Event) -> None:
-    while not stop_event.wait(HEARTBEAT_SECONDS):
+
+def send_resumable_chunk(upload_url: str, offset: int, chunk: bytes, final_length: Optional[int]) -> int:
+    # On failure ask the server how much of the chunk it kept and resend only the rest.
+    start, end = offset, offset + len(chunk)
+    last_err: Optional[Exception] = None
+    for attempt in range(1, RESUMABLE_CHUNK_ATTEMPTS + 1):
         try:
-            update_job(job_id, {
-                "status": "processing",
-                "worker_id": worker_id,
-                "last_heartbeat_at": utc_now_iso(),
-            })
+            if attempt > 1:
+                offset = resumable_offset(upload_url)
+                if offset >= end and final_length is None:
+                    return offset
+            headers = tus_headers()
+            headers["Content-Type"] = "application/offset+octet-stream"
+            headers["Upload-Offset"] = str(offset)
+            if final_length is not None:
+                headers["Upload-Length"] = str(final_length)
+            data = chunk if offset == start else chunk[offset - start:]
+            r = http_session().patch(upload_url, headers=headers, data=data, timeout=UPLOAD_TIMEOUT_SECONDS)
+            if r.status_code >= 300:
+                raise RuntimeError(f"HTTP {r.status_code}: {r.text[:500]}")
+            return int(r.headers.get("Upload-Offset", end))
         except Exception as e:
-            print(f"[heartbeat] {job_id} {e}")
+            last_err = e
+            if attempt < RESUMABLE_CHUNK_ATTEMPTS:
+                time.sleep(min(2 ** attempt, 8))
+    raise RuntimeError(f"resumable upload failed at offset {offset}: {last_err}")
+
+
+def upload_resumable(path: str, chunks: Iterator[bytes], size: Optional[int]) -> None:
+    # Streams of unknown size use TUS deferred length: Upload-Length is sent with the last chunk.
+    upload_url = create_resumable_upload(path, size)
+    offset = 0
+    chunk = next(chunks, b"")
+    while True:
+        following = next(chunks, None)
+        last = following is None
+        final_length = offset + len(chunk) if size is None and last else None
+        offset = send_resumable_chunk(upload_url, offset, chunk, final_length)
+        if last:
+            break
+        chunk = following
+
+
+class HeartbeatScheduler:
+    # One thread refreshes last_heartbeat_at for every registered job with a single
+    # id=in.(...) PATCH per worker_id per tick. The status=eq.processing filter keeps a
+    # late tick from touching a job that has already been finished or rescheduled.
+    max_ids_per_patch = 100
+
+    def __init__(self, interval: int) -> None:
+        self.interval = interval
+        self._jobs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, job_id: str, worker_id: str) -> None:
+        with self._lock:
+            self._jobs[job_id] = worker_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+                self._thread.start()
+
+    def unregister(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def active_jobs(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+
+    def tick(self) -> None:
+        with self._lock:
+            by_worker: Dict[str, list[str]] = {}
+            for job_id, worker_id in self._jobs.items():
+                by_worker.setdefault(worker_id, []).append(job_id)
+        now = utc_now_iso()
+        for worker_id, job_ids in by_worker.items():
+            for i in range(0, len(job_ids), self.max_ids_per_patch):
+                batch = job_ids[i:i + self.max_ids_per_patch]
+                ids = quote(",".join(f'"{job_id}"' for job_id in batch), safe="")
+                try:
+                    with tracing.span("heartbeat", worker_id=worker_id, jobs=len(batch)):
+                        patch_jobs(f"id=in.({ids})&status=eq.processing", {
+                            "worker_id": worker_id,
+                            "last_heartbeat_at": now,
+                        })
+                except Exception as e:
+                    heartbeat_failures.inc()
+                    print(f"[heartbeat] {len(batch)} jobs {e}")
+
+
+heartbeats = HeartbeatScheduler(HEARTBEAT_SECONDS)
+
+
+class JobRegistry:
+    # Job IDs this process has accepted. In-flight entries live until the job ends;
+    # finished ones are kept for ttl seconds so a re-POST of a completed job is a no-op.
+    # Failed jobs are dropped right away so their scheduled retry can run.
+    def __init__(self, ttl: int) -> None:
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float) -> None:
+        expired = [job_id for job_id, e in self._jobs.items() if e["expiresAt"] is not None and e["expiresAt"] <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Registers job_id as queued and returns None, or returns the existing entry.
+        with self._lock:
+            self._purge(time.monotonic())
+            entry = self._jobs.get(job_id)
+            if entry is not None:
+                return {"state": entry["state"], "since": entry["since"]}
+            self._jobs[job_id] = {"state": "queued", "since": utc_now_iso(), "expiresAt": None}
+            return None
+
+    def set_state(self, job_id: str, state: str) -> None:
+        with self._lock:
+            self._jobs[job_id] = {"state": state, "since": utc_now_iso(), "expiresAt": None}
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs[job_id] = {"state": "done", "since": utc_now_iso(), "expiresAt": time.monotonic() + self.ttl}
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            self._purge(time.monotonic())
+            counts: Dict[str, int] = {}
+            for entry in self._jobs.values():
+                counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+            return counts
+
+
+job_registry = JobRegistry(JOB_REGISTRY_TTL_SECONDS)
+
+
+def claim_jobs(worker_id: str, limit: int) -> list[Dict[str, Any]]:
+    url = f"{SUPABASE_URL}/rest/v1/rpc/claim_pdf_organizer_jobs"
+    headers = supabase_headers()
+    headers["Content-Type"] = "application/json"
+    payload = {"p_worker_id": worker_id, "p_limit": limit}
+    r = http_session().post(url, headers=headers, data=json.dumps(payload), timeout=20)
+    if r.status_code >= 300:
+        raise RuntimeError(f"claim_jobs failed {r.status_code}: {r.text[:500]}")
+    rows = r.json()
+    return rows if isinstance(rows, list) else []
+
+
+def job_body_from_row(row: Dict[str, Any], worker_id: str) -> Dict[str, Any]:
+    return {
+        "jobId": str(row["id"]),
+        "checklistPaths": row.get("checklist_paths") or [],
+        "labelsPaths": row.get("labels_paths") or [],
+        "csvData": row.get("csv_data"),
+        "mappingRef": row.get("mapping_ref"),
+        "workerId": worker_id,
+    }
+
+
+def read_exact(stream: IO[bytes], size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            raise RuntimeError("processor stream ended early")
+        buf += chunk
+    return bytes(buf)
+
+
+def release_result(result: Dict[str, Any]) -> None:
+    for key in PROCESSOR_OUTPUT_KEYS:
+        f = result.get(key)
+        if hasattr(f, "close"):
+            f.close()
+    if result.get("inputs") is not None:
+        result["inputs"].close()
+    if result.get("workDir"):
+        shutil.rmtree(result["workDir"], ignore_errors=True)
+
+
+def read_processor_frames(stream: IO[bytes]) -> Dict[str, Any]:
+    # Frame layout: u16 name length, utf-8 name, u64 payload length, payload.
+    # PDF payloads are copied chunk by chunk into spooled temp files; a "stats"
+    # frame carries the JSON stats object. Unknown frames are skipped.
+    result: Dict[str, Any] = {}
+    try:
+        while True:
+            head = stream.read(2)
+            if not head:
+                break
+            head += read_exact(stream, 2 - len(head))
+            name = read_exact(stream, struct.unpack(">H", head)[0]).decode("utf-8")
+            remaining = struct.unpack(">Q", read_exact(stream, 8))[0]
+            if name == "stats":
+                result["stats"] = json.loads(read_exact(stream, remaining))
+                continue
+            sink: Optional[IO[bytes]] = None
+            if name in PROCESSOR_OUTPUT_KEYS:
+                sink = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES)
+                result[name] = sink
+            while remaining:
+                chunk = stream.read(min(remaining, STREAM_CHUNK_BYTES))
+                if not chunk:
+                    raise RuntimeError(f"processor stream ended inside {name}")
+                if sink is not None:
+                    sink.write(chunk)
+                remaining -= len(chunk)
+            if sink is not None:
+                sink.seek(0)
+    except Exception:
+        release_result(result)
+        raise
+    return result
+
+
+def decode_json_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    if not isinstance(data.get("labelsPdf"), str) or not isinstance(data.get("checklistPdf"), str):
+        raise RuntimeError("processor missing labelsPdf/checklistPdf")
+    started = time.monotonic()
+    for key in PROCESSOR_OUTPUT_KEYS:
+        data[key] = io.BytesIO(base64.b64decode(data.pop(key)))
+    elapsed = time.monotonic() - started
+    stage_seconds.observe(elapsed, stage="decode")
+    data["decodeSeconds"] = round(elapsed, 3)
+    return data
 
 
 def call_processor(checklist_paths: list[str], labels_paths: list[str], csv_data: Optional[str]) -> Dict[str, Any]:
@@ -101,94 +665,327 @@ def call_processor(checklist_paths: list[str], labels_paths: list[str], csv_data
     if csv_data and csv_data.strip():
         payload["csvData"] = csv_data
 
-    headers = {"Content-Type": "application/json"}
+    headers = {"Content-Type": "application/json", "Accept": f"{PROCESSOR_FRAMES_CONTENT_TYPE}, application/json"}
     if PROCESSOR_SECRET:
         headers["Authorization"] = f"Bearer {PROCESSOR_SECRET}"
 
+    # One span per attempt, each propagating its own trace context to the processor.
     last_err: Optional[Exception] = None
     for attempt in range(1, PROCESSOR_ATTEMPTS + 1):
+        if attempt > 1:
+            processor_retries.inc()
+            time.sleep(min(2 ** (attempt - 1), 8))
         try:
-            r = requests.post(PROCESSOR_URL, headers=headers, data=json.dumps(payload), timeout=PROCESSOR_TIMEOUT_SECONDS)
-            if r.status_code >= 500 and attempt < PROCESSOR_ATTEMPTS:
-                time.sleep(min(2 ** attempt, 8))
-                continue
-            if r.status_code >= 300:
-                raise RuntimeError(f"processor HTTP {r.status_code}: {r.text[:800]}")
-            data = r.json()
-            if not isinstance(data.get("labelsPdf"), str) or not isinstance(data.get("checklistPdf"), str):
-                raise RuntimeError("processor missing labelsPdf/checklistPdf")
-            return data
+            with tracing.span("call_processor", attempt=attempt) as span:
+                r = http_session().post(PROCESSOR_URL, headers=tracing.inject(dict(headers)), data=json.dumps(payload),
+                                        timeout=PROCESSOR_TIMEOUT_SECONDS, stream=True)
+                with r:
+                    if span is not None:
+                        span.set_attribute("http.status_code", r.status_code)
+                    if r.status_code >= 300:
+                        raise RuntimeError(f"processor HTTP {r.status_code}: {r.text[:800]}")
+                    if r.headers.get("Content-Type", "").startswith(PROCESSOR_FRAMES_CONTENT_TYPE):
+                        r.raw.decode_content = True
+                        data = read_processor_frames(r.raw)
+                        if any(key not in data for key in PROCESSOR_OUTPUT_KEYS):
+                            release_result(data)
+                            raise RuntimeError("processor missing labelsPdf/checklistPdf")
+                    else:
+                        data = decode_json_result(r.json())
+                    data["attempts"] = attempt
+                    return data
         except Exception as e:
             last_err = e
-            if attempt < PROCESSOR_ATTEMPTS:
-                time.sleep(min(2 ** attempt, 8))
     raise RuntimeError(f"processor failed after {PROCESSOR_ATTEMPTS} attempts: {last_err}")
 
 
-def process_job(body: Dict[str, Any]) -> None:
-    job_id = str(body["jobId"])
-    checklist_paths = [x for x in body.get("checklistPaths", []) if isinstance(x, str) and x]
-    labels_paths = [x for x in body.get("labelsPaths", []) if isinstance(x, str) and x]
-    csv_data = body.get("csvData") if isinstance(body.get("csvData"), str) else None
-    worker_id = str(body.get("workerId") or f"render-worker-{os.getpid()}")
+def input_etags(paths: list[str]) -> Optional[Dict[str, str]]:
+    unique = list(dict.fromkeys(paths))
+    futures = [submit_io(object_etag, path) for path in unique]
+    wait(futures)
+    etags = {}
+    for path, f in zip(unique, futures):
+        if f.exception() is not None or not f.result():
+            return None
+        etags[path] = f.result()
+    return etags
+
+
+def result_cache_key(checklist_paths: list[str], labels_paths: list[str], mapping: SkuMapping,
+                     etags: Dict[str, str]) -> str:
+    # Same engine, same input objects (by ETag, in order) and same normalized mapping
+    # produce the same outputs.
+    fingerprint = {
+        "engine": ENGINE,
+        "checklists": [[p, etags[p]] for p in checklist_paths],
+        "labels": [[p, etags[p]] for p in labels_paths],
+        "mapping": mapping.digest,
+        "fuzzy": [FUZZY_MAX_DISTANCE, FUZZY_MIN_LENGTH] if ENGINE == "local" else None,
+    }
+    return hashlib.sha256(json.dumps(fingerprint, separators=(",", ":")).encode("utf-8")).hexdigest()
 
-    stop_event = threading.Event()
-    t = threading.Thread(target=heartbeat_loop, args=(job_id, worker_id, stop_event), daemon=True)
+
+def copy_cached_result(key: str, output_paths: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    cached = result_cache.get(key)
+    if cached is not None and cached["outputPaths"] == output_paths:
+        # An earlier run of this same job with the same inputs: its outputs are in place.
+        stats = {k: v for k, v in cached["stats"].items() if k not in ("uploads", "worker")}
+        stats["resultCache"] = {"hit": True, "source": cached["outputPaths"], "copySeconds": 0.0}
+        return stats
+    # Both the copy below and a recompute rewrite this job's outputs, so entries that
+    # point at them (from an earlier run with other inputs) must go first.
+    result_cache.discard_outputs(output_paths)
+    if cached is None:
+        return None
+    started = time.monotonic()
+    copies = [submit_io(copy_object, cached["outputPaths"][name], output_paths[name]) for name in output_paths]
+    wait(copies)
+    for f in copies:
+        if f.exception() is not None:
+            print(f"[result-cache] copy failed, recomputing: {f.exception()}")
+            result_cache.discard(key)
+            return None
+    stats = {k: v for k, v in cached["stats"].items() if k not in ("uploads", "worker")}
+    stats["resultCache"] = {"hit": True, "source": cached["outputPaths"], "copySeconds": round(time.monotonic() - started, 3)}
+    return stats
+
+
+def run_local_engine(checklist_paths: list[str], labels_paths: list[str], mapping: SkuMapping,
+                     output_paths: Dict[str, str], etags: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    # Each output is uploaded while it is being written: the engine writes into a
+    # ChunkPipe and an io_pool thread streams it to storage, so neither document is
+    # ever held whole in memory or on disk. Uploads are only started once the engine
+    # opens an output, after its input downloads no longer need io_pool threads.
+    result: Dict[str, Any] = {"workDir": tempfile.mkdtemp(prefix="pdf-organizer-"), "inputs": MappedInputs()}
+    storage_paths = {"labels.pdf": output_paths["labelsPath"], "checklists.pdf": output_paths["checklistPath"]}
+    upload_names = {"labels.pdf": "labels", "checklists.pdf": "checklists"}
+    uploads: Dict[str, Any] = {}
+    started = time.monotonic()
+
+    def open_output(name: str) -> ChunkPipe:
+        nonlocal started
+        if not uploads:
+            started = time.monotonic()
+        pipe = ChunkPipe()
+        uploads[upload_names[name]] = submit_io(stream_upload, storage_paths[name], pipe)
+        return pipe
 
     try:
-        update_job(job_id, {
-            "status": "processing",
-            "started_at": utc_now_iso(),
-            "completed_at": None,
-            "error_message": None,
-            "last_error_code": None,
-            "worker_id": worker_id,
-            "last_heartbeat_at": utc_now_iso(),
-            "retry_after": None,
-        })
-        t.start()
-
-        if not checklist_paths or not labels_paths:
-            raise RuntimeError("missing checklistPaths or labelsPaths")
-
-        result = call_processor(checklist_paths, labels_paths, csv_data)
-        labels_pdf = base64.b64decode(result["labelsPdf"])
-        checklist_pdf = base64.b64decode(result["checklistPdf"])
-
-        labels_path = f"pdf-organizer-output/{job_id}/labels.pdf"
-        checklist_path = f"pdf-organizer-output/{job_id}/checklists.pdf"
-
-        upload_pdf(labels_path, labels_pdf)
-        upload_pdf(checklist_path, checklist_pdf)
-
-        update_job(job_id, {
-            "status": "done",
-            "completed_at": utc_now_iso(),
-            "worker_id": None,
-            "last_heartbeat_at": utc_now_iso(),
-            "error_message": None,
-            "last_error_code": None,
-            "retry_after": None,
-            "output_paths": {"labelsPath": labels_path, "checklistPath": checklist_path},
-            "stats": result.get("stats") if isinstance(result.get("stats"), dict) else None,
-        })
-        print(f"[worker] done {job_id}")
-
-    except Exception as e:
-        msg = str(e)
-        print(f"[worker] failed {job_id}: {msg}")
-        try:
-            mark_retry(job_id, msg, "worker_processing_error")
-        except Exception as e2:
-            update_job(job_id, {
-                "status": "failed",
-                "completed_at": utc_now_iso(),
-                "error_message": f"{msg} | mark_retry_failed: {e2}",
-                "last_error_code": "worker_retry_mark_failed",
-                "worker_id": None,
-            })
+        fetch = functools.partial(fetch_inputs, etags=etags)
+        out = pdf_engine.organize(checklist_paths, labels_paths, mapping, fetch, result["workDir"], open_output,
+                                  result["inputs"])
+        result["stats"] = out["stats"]
+        result["uploads"] = collect_uploads(uploads, started)
+    except Exception:
+        # An upload that failed first is the real cause of the writer's error.
+        wait(uploads.values())
+        release_result(result)
+        for f in uploads.values():
+            if f.exception() is not None:
+                raise f.exception()
+        raise
+    return result
+
+
+@contextmanager
+def job_stage(timings: Dict[str, float], name: str) -> Iterator[None]:
+    # Times one stage of a job into both the stage histogram and the job's own stats.
+    started = time.monotonic()
+    try:
+        yield
     finally:
-        stop_event.set()
+        elapsed = time.monotonic() - started
+        stage_seconds.observe(elapsed, stage=name)
+        timings[name] = round(timings.get(name, 0) + elapsed, 3)
+
+
+def worker_stats(result: Dict[str, Any], timings: Dict[str, float], queued_at: Optional[float],
+                 started: float) -> Dict[str, Any]:
+    # The worker's own view of the job, merged into stats as stats.worker so latency can
+    # be broken down with SQL over pdf_organizer_jobs.
+    out: Dict[str, Any] = {
+        "queueWaitSeconds": round(started - queued_at, 3) if queued_at is not None else None,
+        "stageSeconds": timings,
+    }
+    if "attempts" in result:
+        out["processorAttempts"] = result["attempts"]
+        out["processorSeconds"] = timings.get("processor")
+    if "decodeSeconds" in result:
+        out["decodeSeconds"] = result["decodeSeconds"]
+    if "decodedBytes" in result:
+        out["decodedBytes"] = result["decodedBytes"]
+    out["wallSeconds"] = round(time.monotonic() - started, 3)
+    return out
+
+
+def process_job(body: Dict[str, Any], queued_at: Optional[float] = None) -> None:
+    with tracing.span("process_job", job_id=str(body.get("jobId")), engine=ENGINE):
+        started = time.monotonic()
+        timings: Dict[str, float] = {}
+        job_id = str(body["jobId"])
+        checklist_paths = [x for x in body.get("checklistPaths", []) if isinstance(x, str) and x]
+        labels_paths = [x for x in body.get("labelsPaths", []) if isinstance(x, str) and x]
+        csv_data = body.get("csvData") if isinstance(body.get("csvData"), str) else None
+        mapping_ref = body.get("mappingRef") if isinstance(body.get("mappingRef"), str) else None
+        worker_id = str(body.get("workerId") or f"render-worker-{os.getpid()}")
+
+        result: Dict[str, Any] = {}
+        job_registry.set_state(job_id, "processing")
+
+        try:
+            with job_stage(timings, "status_update"):
+                update_job(job_id, {
+                    "status": "processing",
+                    "started_at": utc_now_iso(),
+                    "completed_at": None,
+                    "error_message": None,
+                    "last_error_code": None,
+                    "worker_id": worker_id,
+                    "last_heartbeat_at": utc_now_iso(),
+                    "retry_after": None,
+                })
+            heartbeats.register(job_id, worker_id)
+
+            if not checklist_paths or not labels_paths:
+                raise RuntimeError("missing checklistPaths or labelsPaths")
+
+            labels_path = f"pdf-organizer-output/{job_id}/labels.pdf"
+            checklist_path = f"pdf-organizer-output/{job_id}/checklists.pdf"
+            output_paths = {"labelsPath": labels_path, "checklistPath": checklist_path}
+
+            with job_stage(timings, "mapping"):
+                mapping = mapping_store.get(mapping_ref) if mapping_ref else compile_mapping(csv_data)
+
+            with job_stage(timings, "result_cache"):
+                etags = input_etags(checklist_paths + labels_paths) if result_cache.enabled else None
+                cache_key = result_cache_key(checklist_paths, labels_paths, mapping, etags) if etags else None
+                stats = copy_cached_result(cache_key, output_paths) if cache_key else None
+
+            if stats is None:
+                result_cache.discard_outputs(output_paths)
+                if ENGINE == "local":
+                    with job_stage(timings, "local_engine"):
+                        result = run_local_engine(checklist_paths, labels_paths, mapping, output_paths, etags)
+                    upload_stats = result["uploads"]
+                else:
+                    with job_stage(timings, "processor"):
+                        result = call_processor(checklist_paths, labels_paths,
+                                                mapping.to_csv() if mapping_ref else csv_data)
+                    result["decodedBytes"] = {key: content_length(result[key]) for key in PROCESSOR_OUTPUT_KEYS}
+                    uploads_started = time.monotonic()
+                    upload_stats = collect_uploads({
+                        "labels": submit_io(timed_upload, labels_path, result["labelsPdf"]),
+                        "checklists": submit_io(timed_upload, checklist_path, result["checklistPdf"]),
+                    }, uploads_started)
+
+                stats = dict(result["stats"]) if isinstance(result.get("stats"), dict) else {}
+                stats["uploads"] = upload_stats
+                if cache_key:
+                    result_cache.put(cache_key, output_paths, stats,
+                                     sum(upload_stats[name]["bytes"] or 0 for name in ("labels", "checklists")))
+
+            stats = dict(stats)
+            stats["worker"] = worker_stats(result, timings, queued_at, started)
+            with job_stage(timings, "final_update"):
+                update_job(job_id, {
+                    "status": "done",
+                    "completed_at": utc_now_iso(),
+                    "worker_id": None,
+                    "last_heartbeat_at": utc_now_iso(),
+                    "error_message": None,
+                    "last_error_code": None,
+                    "retry_after": None,
+                    "output_paths": output_paths,
+                    "stats": stats,
+                })
+            job_registry.finish(job_id)
+            jobs_finished.inc(outcome="done")
+            print(f"[worker] done {job_id}")
+
+        except Exception as e:
+            msg = str(e)
+            print(f"[worker] failed {job_id}: {msg}")
+            job_registry.release(job_id)
+            try:
+                mark_retry(job_id, msg, "worker_processing_error")
+                jobs_finished.inc(outcome="retry")
+            except Exception as e2:
+                jobs_finished.inc(outcome="failed")
+                update_job(job_id, {
+                    "status": "failed",
+                    "completed_at": utc_now_iso(),
+                    "error_message": f"{msg} | mark_retry_failed: {e2}",
+                    "last_error_code": "worker_retry_mark_failed",
+                    "worker_id": None,
+                })
+        finally:
+            heartbeats.unregister(job_id)
+            release_result(result)
+
+
+class JobExecutor:
+    # Fixed pool of job threads in front of a bounded queue. submit() refuses work
+    # once every slot is busy and the queue is full so callers can shed load early.
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: "queue.Queue[tuple[Callable[..., None], tuple[Any, ...]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._pending = 0
+        self._active = 0
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn: Callable[..., None], *args: Any) -> bool:
+        with self._lock:
+            self._ensure_started()
+            if self._pending >= self.workers + self.queue_size:
+                return False
+            self._pending += 1
+        self._queue.put((fn, args))
+        return True
+
+    def _run(self) -> None:
+        while True:
+            fn, args = self._queue.get()
+            with self._lock:
+                self._active += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[executor] job crashed: {e}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._pending -= 1
+
+    def free_slots(self) -> int:
+        with self._lock:
+            return max(0, self.workers - self._pending)
+
+    def idle(self) -> bool:
+        with self._lock:
+            return self._pending == 0
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "activeSlots": self._active,
+                "freeSlots": self.workers - self._active,
+                "queueDepth": self._pending - self._active,
+                "queueSize": self.queue_size,
+            }
+
+
+job_executor = JobExecutor(JOB_CONCURRENCY, JOB_QUEUE_SIZE)
 
 
 def auth_ok(req) -> bool:
@@ -202,7 +999,17 @@ def health():
     err = ensure_env()
     if err:
         return jsonify({"ok": False, "error": err}), 500
-    return jsonify({"ok": True, "status": "healthy"}), 200
+    return jsonify({"ok": True, "status": "healthy", "executor": job_executor.snapshot(),
+                    "heartbeatJobs": heartbeats.active_jobs(), "inputCache": input_cache.snapshot(),
+                    "resultCache": result_cache.snapshot(),
+                    "mappingCache": mapping_cache_info(),
+                    "mappingStore": mapping_store.snapshot(),
+                    "jobs": job_registry.counts()}), 200
+
+
+@app.get("/worker/metrics")
+def worker_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 @app.post("/worker/process-pdf-organizer-job")
@@ -223,11 +1030,74 @@ def process_pdf_organizer_job():
         return jsonify({"ok": False, "error": "jobId is required"}), 400
     if not isinstance(body.get("checklistPaths"), list) or not isinstance(body.get("labelsPaths"), list):
         return jsonify({"ok": False, "error": "checklistPaths and labelsPaths must be arrays"}), 400
+    if body.get("mappingRef") is not None and (not isinstance(body["mappingRef"], str)
+                                               or not MAPPING_REF_PATTERN.match(body["mappingRef"])):
+        return jsonify({"ok": False, "error": "mappingRef must look like mappingId@version"}), 400
+
+    existing = job_registry.claim(str(body["jobId"]))
+    if existing is not None:
+        return jsonify({"ok": True, "accepted": False, "duplicate": True, "jobId": body["jobId"], **existing}), 202
 
-    threading.Thread(target=process_job, args=(body,), daemon=True).start()
+    if not job_executor.submit(process_job, body, time.monotonic()):
+        job_registry.release(str(body["jobId"]))
+        resp = jsonify({"ok": False, "error": "Worker is at capacity", "jobId": body["jobId"]})
+        resp.headers["Retry-After"] = str(QUEUE_FULL_RETRY_AFTER_SECONDS)
+        return resp, 503
     return jsonify({"ok": True, "accepted": True, "jobId": body["jobId"]}), 202
 
 
-if __name__ == "__main__":
+def run_queue_consumer() -> None:
+    # Pull mode: claim queued jobs straight from pdf_organizer_jobs (see
+    # sql/claim_pdf_organizer_jobs.sql), never more than there are free job slots.
+    err = ensure_env()
+    if err:
+        raise SystemExit(err)
+    worker_id = os.environ.get("PDF_ORGANIZER_WORKER_ID") or f"queue-worker-{socket.gethostname()}-{os.getpid()}"
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    print(f"[consumer] {worker_id} polling with {job_executor.workers} slots")
+
+    while not stopping.is_set():
+        free = job_executor.free_slots()
+        if free == 0:
+            stopping.wait(POLL_SECONDS / 4)
+            continue
+        try:
+            rows = claim_jobs(worker_id, free)
+        except Exception as e:
+            print(f"[consumer] claim failed: {e}")
+            stopping.wait(POLL_SECONDS)
+            continue
+        for row in rows:
+            body = job_body_from_row(row, worker_id)
+            # The claim RPC already moved this row to processing for us and SKIP LOCKED
+            # never hands a row out twice, so no duplicate check: a job re-queued soon
+            # after it finished here must run again rather than be left in processing.
+            job_registry.set_state(body["jobId"], "queued")
+            if not job_executor.submit(process_job, body, time.monotonic()):
+                job_registry.release(body["jobId"])
+                print(f"[consumer] no slot for claimed job {body['jobId']}, marking retry")
+                try:
+                    mark_retry(body["jobId"], "worker had no free slot for claimed job", "worker_no_capacity")
+                except Exception as e:
+                    print(f"[consumer] mark_retry failed for {body['jobId']}: {e}")
+        if len(rows) < free:
+            stopping.wait(POLL_SECONDS)
+
+    deadline = time.monotonic() + DRAIN_TIMEOUT_SECONDS
+    while not job_executor.idle() and time.monotonic() < deadline:
+        time.sleep(0.5)
+    print(f"[consumer] {worker_id} stopped")
+
+
+def run_dev_server() -> None:
     port = int(os.environ.get("PORT", "10000"))
     app.run(host="0.0.0.0", port=port, debug=False)
+
+
+if __name__ == "__main__":
+    # Never run with app.py as __main__: the page-indexing pool spawns its processes by
+    # re-running __main__, which would redo all of the setup above in each of them.
+    entry = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    os.execv(sys.executable, [sys.executable, entry] + ([] if sys.argv[1:2] == ["worker"] else ["web"]))
@@ -0,0 +1,233 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# In-process stand-ins for everything the worker talks to: PostgREST (job updates and
+# RPCs), Storage (object GET/HEAD/upload/copy and TUS resumable uploads) and the PDF
+# processor. Uploaded bodies are counted and discarded, so a long run stays small.
+
+FRAMES_CONTENT_TYPE = "application/x-pdf-organizer-frames"
+
+
+class ProcessorProfile:
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 0, payload_bytes: int = 256 * 1024,
+                 failure_rate: float = 0.0, seed: int = 0) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.payload_bytes = payload_bytes
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple[float, bool]:
+        # (seconds to wait, whether this call fails)
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            return max(0.0, self.latency_ms + jitter) / 1000, self._random.random() < self.failure_rate
+
+    def payload(self, name: str) -> bytes:
+        head = b"%PDF-1.7\n% fake " + name.encode("ascii") + b"\n"
+        return head + b"0" * max(0, self.payload_bytes - len(head))
+
+
+class FakeState:
+    def __init__(self, processor: ProcessorProfile, objects_dir: Optional[str] = None) -> None:
+        self.processor = processor
+        self.objects_dir = objects_dir
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        # job id -> (outcome, monotonic time) for the last terminal update seen
+        self.outcomes: Dict[str, tuple[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.uploaded_bytes = 0
+        self.tus: Dict[str, Dict[str, Any]] = {}
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def finish(self, job_id: str, outcome: str) -> None:
+        with self.finished:
+            self.outcomes[job_id] = (outcome, time.monotonic())
+            self.finished.notify_all()
+
+    def wait_for(self, job_id: str, timeout: float) -> Optional[tuple[str, float]]:
+        deadline = time.monotonic() + timeout
+        with self.finished:
+            while job_id not in self.outcomes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.finished.wait(remaining)
+            return self.outcomes[job_id]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: FakeState
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(parts)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def reply(self, code: int, data: bytes = b"", content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def object_file(self, path: str) -> Optional[str]:
+        root = self.state.objects_dir
+        if not root:
+            return None
+        # /storage/v1/object/{bucket}/{key}
+        key = unquote(path.split("/", 5)[5]) if path.count("/") >= 5 else ""
+        full = os.path.normpath(os.path.join(root, key))
+        if not full.startswith(os.path.normpath(root) + os.sep) or not os.path.isfile(full):
+            return None
+        return full
+
+    def object_etag(self, path: str, full: Optional[str]) -> str:
+        # HEAD and GET must agree: the worker caches a download under the GET ETag and
+        # looks it up under the HEAD one.
+        tag = hashlib.sha1((full or path).encode("utf-8")).hexdigest()
+        if full is not None:
+            tag += f"-{os.path.getmtime(full)}"
+        return f'"{tag}"'
+
+    # Storage
+
+    def do_HEAD(self) -> None:
+        path = urlsplit(self.path).path
+        if path.startswith("/storage/v1/upload/resumable/"):
+            upload = self.state.tus.get(path)
+            if upload is None:
+                return self.reply(404)
+            return self.reply(200, headers={"Upload-Offset": str(upload["offset"]), "Tus-Resumable": "1.0.0"})
+        if path.startswith("/storage/v1/object/"):
+            full = self.object_file(path)
+            if self.state.objects_dir and full is None:
+                return self.reply(404)
+            return self.reply(200, headers={"ETag": self.object_etag(path, full)})
+        self.reply(404)
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        if path.startswith("/storage/v1/object/"):
+            full = self.object_file(path)
+            if full is None:
+                return self.reply(404, b'{"error":"not found"}')
+            with open(full, "rb") as f:
+                return self.reply(200, f.read(), "application/pdf", {"ETag": self.object_etag(path, full)})
+        self.reply(404)
+
+    def do_PATCH(self) -> None:
+        url = urlsplit(self.path)
+        body = self.read_body()
+        if url.path.startswith("/storage/v1/upload/resumable/"):
+            upload = self.state.tus.get(url.path)
+            if upload is None or int(self.headers.get("Upload-Offset", -1)) != upload["offset"]:
+                return self.reply(409)
+            upload["offset"] += len(body)
+            with self.state.lock:
+                self.state.uploaded_bytes += len(body)
+            return self.reply(204, headers={"Upload-Offset": str(upload["offset"]), "Tus-Resumable": "1.0.0"})
+        if url.path == "/rest/v1/pdf_organizer_jobs":
+            query = parse_qs(url.query)
+            payload = json.loads(body or b"{}")
+            job_filter = query.get("id", [""])[0]
+            if job_filter.startswith("in."):
+                self.state.count("heartbeats")
+            elif payload.get("status") in ("done", "failed"):
+                self.state.finish(job_filter[len("eq."):], payload["status"])
+            else:
+                self.state.count("jobUpdates")
+            return self.reply(204)
+        self.reply(404)
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        body = self.read_body()
+        if url.path == "/process":
+            return self.process()
+        if url.path == "/rest/v1/rpc/mark_pdf_organizer_job_retry":
+            self.state.finish(json.loads(body)["p_job_id"], "retry")
+            return self.reply(200, b"null")
+        if url.path.startswith("/rest/v1/rpc/"):
+            return self.reply(200, b"[]")
+        if url.path == "/storage/v1/upload/resumable":
+            with self.state.lock:
+                location = f"/storage/v1/upload/resumable/{len(self.state.tus)}"
+                self.state.tus[location] = {"offset": 0}
+            return self.reply(201, headers={"Location": location, "Tus-Resumable": "1.0.0"})
+        if url.path == "/storage/v1/object/copy":
+            self.state.count("copies")
+            return self.reply(200, b"{}")
+        if url.path.startswith("/storage/v1/object/"):
+            with self.state.lock:
+                self.state.uploaded_bytes += len(body)
+            return self.reply(200, b"{}")
+        self.reply(404)
+
+    # Processor
+
+    def process(self) -> None:
+        self.state.count("processorCalls")
+        delay, fail = self.state.processor.draw()
+        time.sleep(delay)
+        if fail:
+            self.state.count("processorFailures")
+            return self.reply(503, b'{"error":"injected failure"}')
+        profile = self.state.processor
+        stats = json.dumps({"fake": True, "payloadBytes": profile.payload_bytes}).encode("utf-8")
+        outputs = [("labelsPdf", profile.payload("labels")), ("checklistPdf", profile.payload("checklists"))]
+        if FRAMES_CONTENT_TYPE in self.headers.get("Accept", ""):
+            frames = [("stats", stats)] + outputs
+            data = b"".join(struct.pack(">H", len(n)) + n.encode("utf-8") + struct.pack(">Q", len(p)) + p
+                            for n, p in frames)
+            return self.reply(200, data, FRAMES_CONTENT_TYPE)
+        doc = {name: base64.b64encode(payload).decode("ascii") for name, payload in outputs}
+        doc["stats"] = json.loads(stats)
+        self.reply(200, json.dumps(doc).encode("utf-8"))
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Keep-alive connections reset when the worker under test is stopped.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start(state: FakeState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundHandler", (Handler,), {"state": state})
+    server = Server((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    return server
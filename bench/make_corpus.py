@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import os
+import random
+import string
+import zlib
+from typing import Any, Dict, Optional
+
+# Deterministic synthetic inputs for the organizer: 4x6 shipping labels and letter-size
+# packing slips that reference the same orders, plus the SKU mapping CSV that ties
+# checklist SKUs to label SKUs where they differ. The same arguments and seed always
+# produce byte-identical files, so benchmark runs are comparable without customer data.
+#
+#   python bench/make_corpus.py --out corpus --pages 5000 --skus 400 --mismatch-rate 0.05 --seed 7
+#
+# Writes checklists.pdf, labels-<n>.pdf (split over --label-files), mapping.csv and
+# manifest.json, which records the parameters and the expected match counts.
+
+LABEL_SIZE = (288, 432)
+SLIP_SIZE = (612, 792)
+CARRIERS = ("USPS GROUND ADVANTAGE", "UPS GROUND", "FEDEX HOME DELIVERY")
+STREETS = ("MAPLE", "OAK", "CEDAR", "PINE", "ELM", "WILLOW", "BIRCH", "ASH")
+CITIES = (("AUSTIN", "TX", "787"), ("DENVER", "CO", "802"), ("SEATTLE", "WA", "981"), ("TAMPA", "FL", "336"),
+          ("COLUMBUS", "OH", "432"), ("RENO", "NV", "895"))
+
+
+def pdf_string(text: str) -> str:
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def text_stream(lines: list[tuple[float, float, int, str]]) -> bytes:
+    # (x, y, font size, text) per line, drawn with the shared Helvetica font.
+    ops = []
+    for x, y, size, text in lines:
+        ops.append(f"BT /F1 {size} Tf {x} {y} Td {pdf_string(text)} Tj ET")
+    return "\n".join(ops).encode("latin-1")
+
+
+def write_pdf(path: str, pages: list[tuple[tuple[int, int], bytes]]) -> int:
+    # Minimal PDF: catalog, page tree, one shared font, and a page plus a Flate
+    # content stream per page. No dates or IDs, so the output is reproducible.
+    objects: list[bytes] = [b"", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for (width, height), content in pages:
+        data = zlib.compress(content, 6)
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream")
+        content_num = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> "
+                       b"/Contents %d 0 R >>" % (width, height, content_num))
+        kids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return len(out)
+
+
+class Corpus:
+    def __init__(self, pages: int, skus: int, mismatch_rate: float, mapped_rate: float, typo_rate: float,
+                 missing_order_rate: float, seed: int) -> None:
+        self.pages = pages
+        self.mismatch_rate = mismatch_rate
+        self.typo_rate = typo_rate
+        self.missing_order_rate = missing_order_rate
+        self.rng = random.Random(seed)
+        # Label SKUs are what the warehouse prints; a mapped_rate share of products is
+        # listed under a different catalog SKU on packing slips and needs mapping.csv.
+        self.label_skus = [self.sku(prefix) for prefix in self.rng.choices(("N5", "KT", "WX", "RB"), k=skus)]
+        self.checklist_skus = [self.asin() if self.rng.random() < mapped_rate else s for s in self.label_skus]
+
+    def sku(self, prefix: str) -> str:
+        chars = string.ascii_uppercase + string.digits
+        return f"{prefix}-{''.join(self.rng.choices(chars, k=4))}-{''.join(self.rng.choices(chars, k=4))}"
+
+    def asin(self) -> str:
+        return "B0" + "".join(self.rng.choices(string.ascii_uppercase + string.digits, k=8))
+
+    def order_id(self) -> str:
+        return f"{self.rng.randint(100, 999)}-{self.rng.randint(0, 9999999):07d}-{self.rng.randint(0, 9999999):07d}"
+
+    def tracking(self, carrier: str) -> str:
+        if carrier.startswith("UPS"):
+            return "1Z" + "".join(self.rng.choices(string.ascii_uppercase + string.digits, k=16))
+        digits = "94" + "".join(self.rng.choices(string.digits, k=20))
+        return " ".join(digits[i:i + 4] for i in range(0, len(digits), 4))
+
+    def typo(self, sku: str) -> str:
+        # One substituted character, never the separators, so it stays a valid token.
+        positions = [i for i, c in enumerate(sku) if c.isalnum() and i > 1]
+        i = self.rng.choice(positions)
+        replacement = self.rng.choice([c for c in string.ascii_uppercase + string.digits if c != sku[i]])
+        return sku[:i] + replacement + sku[i + 1:]
+
+    def address(self) -> list[str]:
+        city, state, zip3 = self.rng.choice(CITIES)
+        name = "".join(self.rng.choices(string.ascii_uppercase, k=self.rng.randint(4, 8)))
+        return [f"{name} {self.rng.choice(string.ascii_uppercase)}.",
+                f"{self.rng.randint(10, 9999)} {self.rng.choice(STREETS)} ST",
+                f"{city} {state} {zip3}{self.rng.randint(0, 99):02d}"]
+
+    def build(self) -> Dict[str, Any]:
+        labels, slips = [], []
+        expected = {"exact": 0, "mapped": 0, "typo": 0, "mismatched": 0, "orderMatched": 0}
+        for _ in range(self.pages):
+            product = self.rng.randrange(len(self.label_skus))
+            label_sku, checklist_sku = self.label_skus[product], self.checklist_skus[product]
+            order, carrier = self.order_id(), self.rng.choice(CARRIERS)
+            label_order: Optional[str] = order
+            roll = self.rng.random()
+            if roll < self.mismatch_rate:
+                # A stray label for some other order and product, and no label for this slip.
+                label_order, label_sku = self.order_id(), self.sku("ZZ")
+                expected["mismatched"] += 1
+            elif roll < self.mismatch_rate + self.typo_rate and checklist_sku == label_sku:
+                checklist_sku = self.typo(checklist_sku)
+                expected["typo"] += 1
+            elif checklist_sku != label_sku:
+                expected["mapped"] += 1
+            else:
+                expected["exact"] += 1
+            if self.missing_order_rate and self.rng.random() < self.missing_order_rate:
+                # Printed without the order number, so only the SKU can pair it.
+                label_order = None
+            elif roll >= self.mismatch_rate:
+                expected["orderMatched"] += 1
+            labels.append(self.label_page(carrier, label_order, label_sku))
+            slips.append(self.slip_page(order, checklist_sku))
+        # Labels arrive in a different order than the slips, as they do from carriers.
+        self.rng.shuffle(labels)
+        return {"labels": labels, "slips": slips, "expected": expected}
+
+    def label_page(self, carrier: str, order: Optional[str], sku: str) -> tuple[tuple[int, int], bytes]:
+        lines = [(18, 400, 14, carrier), (18, 380, 8, "FROM: RETURNS CENTER 100 DEPOT RD")]
+        lines += [(18, 340 - 14 * i, 11, line) for i, line in enumerate(["SHIP TO:"] + self.address())]
+        if order is not None:
+            lines.append((18, 250, 10, f"ORDER # {order}"))
+        lines += [(18, 234, 10, f"SKU: {sku}"), (18, 218, 10, "QTY 1"),
+                  (18, 120, 9, "TRACKING #"), (18, 106, 11, self.tracking(carrier))]
+        return LABEL_SIZE, text_stream(lines)
+
+    def slip_page(self, order: str, sku: str) -> tuple[tuple[int, int], bytes]:
+        lines = [(54, 740, 18, "PACKING SLIP"), (54, 716, 10, f"Order # {order}")]
+        lines += [(54, 690 - 12 * i, 10, line) for i, line in enumerate(self.address())]
+        lines += [(54, 600, 10, "QTY   ITEM"),
+                  (54, 584, 10, f"1     SKU: {sku}"),
+                  (90, 570, 9, f"Replacement part {self.rng.randint(1, 400)}"),
+                  (54, 100, 8, "Thank you for your order.")]
+        return SLIP_SIZE, text_stream(lines)
+
+
+def write_corpus(out_dir: str, pages: int, skus: int, mismatch_rate: float, mapped_rate: float = 0.3,
+                 typo_rate: float = 0.0, missing_order_rate: float = 0.0, label_files: int = 1,
+                 seed: int = 0) -> Dict[str, Any]:
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = Corpus(pages, skus, mismatch_rate, mapped_rate, typo_rate, missing_order_rate, seed)
+    built = corpus.build()
+
+    files: Dict[str, Any] = {"checklists": ["checklists.pdf"], "labels": [], "mapping": "mapping.csv"}
+    sizes = {"checklists.pdf": write_pdf(os.path.join(out_dir, "checklists.pdf"), built["slips"])}
+    per_file = -(-len(built["labels"]) // max(1, label_files))
+    for n in range(max(1, label_files)):
+        name = f"labels-{n}.pdf"
+        sizes[name] = write_pdf(os.path.join(out_dir, name), built["labels"][n * per_file:(n + 1) * per_file])
+        files["labels"].append(name)
+
+    with open(os.path.join(out_dir, "mapping.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(("checklist_sku", "label_sku"))
+        writer.writerows(sorted({(c, l) for c, l in zip(corpus.checklist_skus, corpus.label_skus) if c != l}))
+
+    manifest = {
+        "seed": seed,
+        "params": {"pages": pages, "skus": skus, "mismatchRate": mismatch_rate, "mappedRate": mapped_rate,
+                   "typoRate": typo_rate, "missingOrderRate": missing_order_rate, "labelFiles": label_files},
+        "files": files,
+        "bytes": sizes,
+        # Per order, by construction. orderMatched pages are paired on the order number;
+        # the rest fall back to SKUs, and since SKUs repeat across orders the engine's
+        # exact/fuzzy split of those can differ from exact/mapped/typo here. matched
+        # (with the fuzzy fallback on) and the unmatched totals agree.
+        "expected": {**built["expected"], "matched": sum(built["expected"][k] for k in ("exact", "mapped", "typo")),
+                     "unmatchedChecklistPages": built["expected"]["mismatched"],
+                     "unmatchedLabelPages": built["expected"]["mismatched"]},
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a deterministic label/checklist corpus.")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--pages", type=int, default=1000, help="orders, i.e. label pages and checklist pages each")
+    parser.add_argument("--skus", type=int, default=200, help="distinct products")
+    parser.add_argument("--mismatch-rate", type=float, default=0.05, help="share of slips whose label is missing")
+    parser.add_argument("--mapped-rate", type=float, default=0.3, help="share of products needing mapping.csv")
+    parser.add_argument("--typo-rate", type=float, default=0.0, help="share of slips with a one-character SKU typo")
+    parser.add_argument("--missing-order-rate", type=float, default=0.0,
+                        help="share of labels printed without the order number")
+    parser.add_argument("--label-files", type=int, default=1, help="split labels over this many PDFs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = write_corpus(args.out, args.pages, args.skus, args.mismatch_rate, args.mapped_rate, args.typo_rate,
+                            args.missing_order_rate, args.label_files, args.seed)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_services import FakeState, ProcessorProfile, start  # noqa: E402
+
+# Throughput benchmark for the web worker. Starts the fake PostgREST/Storage/processor
+# services, boots the worker against them the way the Procfile does (gunicorn, one
+# worker process), keeps --concurrency jobs in flight through
+# POST /worker/process-pdf-organizer-job and reports throughput, end-to-end latency
+# (POST until the job's final status reaches PostgREST), and peak RSS and thread count
+# summed over the worker's whole process tree.
+#
+#   python bench/run_bench.py --jobs 500 --concurrency 16 --latency-ms 300 --payload-bytes 2000000
+#   python bench/run_bench.py --engine local --corpus corpus   (inputs from bench/make_corpus.py)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def proc_status(pid: int) -> Dict[str, int]:
+    # VmRSS (kB) and Threads from /proc; empty where /proc is unavailable or pid is gone.
+    out: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "Threads"):
+                    out[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return out
+
+
+def process_tree(root: int) -> list[int]:
+    # root and all of its descendants. Children are listed per thread, and the page
+    # pool is spawned from a job thread, so every task's children file is read.
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        try:
+            tasks = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending.extend(int(p) for p in f.read().split())
+            except OSError:
+                pass
+    return pids
+
+
+class Sampler(threading.Thread):
+    # Samples the whole worker process tree (gunicorn master, app process, page-pool
+    # processes) and keeps the peak of its summed RSS, thread and process counts.
+    def __init__(self, root: int, interval: float = 0.1) -> None:
+        super().__init__(name="sampler", daemon=True)
+        self.root = root
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.max_threads = 0
+        self.max_processes = 0
+        self._stopping = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            self.sample()
+            self._stopping.wait(self.interval)
+
+    def sample(self) -> None:
+        statuses = [s for s in map(proc_status, process_tree(self.root)) if s]
+        self.peak_rss_kb = max(self.peak_rss_kb, sum(s.get("VmRSS", 0) for s in statuses))
+        self.max_threads = max(self.max_threads, sum(s.get("Threads", 0) for s in statuses))
+        self.max_processes = max(self.max_processes, len(statuses))
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self.join()
+        self.sample()
+
+
+def start_worker(args: argparse.Namespace, fake_url: str, port: int, work_dir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "SUPABASE_URL": fake_url,
+        "SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "PDF_ORGANIZER_PROCESSOR_URL": f"{fake_url}/process",
+        "PDF_ORGANIZER_ENGINE": args.engine,
+        "PDF_ORGANIZER_WORKER_CONCURRENCY": str(args.worker_concurrency),
+        "PDF_ORGANIZER_WORKER_QUEUE_SIZE": str(args.queue_size),
+        "PDF_ORGANIZER_INPUT_CACHE_DIR": os.path.join(work_dir, "inputs"),
+        "PDF_ORGANIZER_RESULT_CACHE_MAX_BYTES": env.get("PDF_ORGANIZER_RESULT_CACHE_MAX_BYTES", "0"),
+    })
+    env.pop("PDF_ORGANIZER_WORKER_SECRET", None)
+    if args.server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+               "--timeout", "600", "--workers", "1"]
+    else:
+        cmd = [sys.executable, "worker.py", "web"]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL if args.quiet else None,
+                            stderr=subprocess.DEVNULL if args.quiet else None)
+
+
+def wait_ready(base: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"worker exited with {proc.returncode} during startup")
+        try:
+            if requests.get(f"{base}/worker/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise SystemExit("worker did not become healthy")
+
+
+def drive(args: argparse.Namespace, base: str, state: FakeState) -> Dict[str, Any]:
+    latencies: list[float] = []
+    outcomes: Dict[str, int] = {}
+    rejected = 0
+    lock = threading.Lock()
+    next_job = iter(range(args.jobs))
+    run_id = f"bench-{int(time.time())}"
+
+    def client() -> None:
+        nonlocal rejected
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(next_job, None)
+            if i is None:
+                return
+            job_id = f"{run_id}-{i}"
+            body = {"jobId": job_id, "checklistPaths": args.checklist, "labelsPaths": args.labels}
+            if args.csv_data:
+                body["csvData"] = args.csv_data
+            started = time.monotonic()
+            while True:
+                r = session.post(f"{base}/worker/process-pdf-organizer-job", json=body, timeout=30)
+                if r.status_code != 503:
+                    break
+                with lock:
+                    rejected += 1
+                time.sleep(args.retry_after)
+            if r.status_code != 202:
+                outcome = f"http_{r.status_code}"
+            else:
+                finished = state.wait_for(job_id, args.job_timeout)
+                outcome = finished[0] if finished else "timeout"
+                if finished:
+                    with lock:
+                        latencies.append(finished[1] - started)
+            with lock:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    clients = [threading.Thread(target=client, name=f"client-{n}") for n in range(args.concurrency)]
+    started = time.monotonic()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    wall = time.monotonic() - started
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "wallSeconds": round(wall, 3),
+        "jobsPerSecond": round(outcomes.get("done", 0) / wall, 2) if wall > 0 else None,
+        "outcomes": outcomes,
+        "rejected503": rejected,
+        "latencyMs": {"p50": ms(percentile(latencies, 50)), "p95": ms(percentile(latencies, 95)),
+                      "p99": ms(percentile(latencies, 99)), "max": ms(max(latencies, default=None))},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the PDF organizer web worker against fake services.")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="jobs kept in flight by the driver")
+    parser.add_argument("--worker-concurrency", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=200, help="fake processor latency")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--payload-bytes", type=int, default=256 * 1024, help="size of each fake output PDF")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of processor calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=("remote", "local"), default="remote")
+    parser.add_argument("--corpus", help="directory from bench/make_corpus.py; sets objects, paths and csvData")
+    parser.add_argument("--objects-dir", help="directory served as storage objects (for --engine local)")
+    parser.add_argument("--checklist", action="append", help="checklist object path (repeatable)")
+    parser.add_argument("--labels", action="append", help="labels object path (repeatable)")
+    parser.add_argument("--csv-data", help="file whose contents are sent as csvData")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="client wait after a 503, seconds")
+    parser.add_argument("--job-timeout", type=float, default=900)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--quiet", action="store_true", help="discard the worker's output")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(os.path.join(args.corpus, "manifest.json"), encoding="utf-8") as f:
+            files = json.load(f)["files"]
+        args.objects_dir = args.objects_dir or args.corpus
+        args.checklist = args.checklist or files["checklists"]
+        args.labels = args.labels or files["labels"]
+        args.csv_data = args.csv_data or os.path.join(args.corpus, files["mapping"])
+    args.checklist = args.checklist or ["bench/checklist.pdf"]
+    args.labels = args.labels or ["bench/labels.pdf"]
+    if args.csv_data:
+        with open(args.csv_data, encoding="utf-8") as f:
+            args.csv_data = f.read()
+    if args.engine == "local" and not args.objects_dir:
+        parser.error("--engine local needs --objects-dir with the input PDFs")
+
+    profile = ProcessorProfile(args.latency_ms, args.jitter_ms, args.payload_bytes, args.failure_rate, args.seed)
+    state = FakeState(profile, args.objects_dir)
+    server = start(state)
+    fake_url = f"http://127.0.0.1:{server.server_port}"
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    work_dir = tempfile.mkdtemp(prefix="pdf-organizer-bench-")
+    proc = start_worker(args, fake_url, port, work_dir)
+    try:
+        wait_ready(base, proc)
+        sampler = Sampler(proc.pid)
+        sampler.start()
+        report = drive(args, base, state)
+        sampler.stop()
+        report["inputCache"] = requests.get(f"{base}/worker/health", timeout=5).json().get("inputCache")
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report.update({
+        "engine": args.engine,
+        "processor": {"latencyMs": args.latency_ms, "jitterMs": args.jitter_ms, "payloadBytes": args.payload_bytes,
+                      "failureRate": args.failure_rate},
+        "peakRssMb": round(sampler.peak_rss_kb / 1024, 1) if sampler.peak_rss_kb else None,
+        "maxThreads": sampler.max_threads or None,
+        "maxProcesses": sampler.max_processes or None,
+        "uploadedMb": round(state.uploaded_bytes / 1024 ** 2, 1),
+        "fake": dict(state.counts),
+    })
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import hashlib
+import mmap
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+# Other processes may share the cache directory, so a .tmp file is only treated as
+# left behind by a crash once it is this old.
+STALE_TMP_SECONDS = 3600
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MappedInputs:
+    # Read-only maps of a job's downloaded inputs. Parsers read from the page cache
+    # instead of a bytes copy of each file, so a large input costs address space and
+    # reclaimable cache rather than heap. Owned by the job and closed when it ends.
+    def __init__(self) -> None:
+        self._maps: list[mmap.mmap] = []
+        self._lock = threading.Lock()
+
+    def open(self, path: str) -> mmap.mmap:
+        mapped = map_file(path)
+        with self._lock:
+            self._maps.append(mapped)
+        return mapped
+
+    @property
+    def bytes(self) -> int:
+        with self._lock:
+            return sum(len(m) for m in self._maps if not m.closed)
+
+    def close(self) -> None:
+        with self._lock:
+            maps, self._maps = self._maps, []
+        for m in maps:
+            m.close()
+
+
+class InputCache:
+    # On-disk LRU of downloaded input PDFs keyed by (storage path, ETag) and bounded by
+    # total bytes. Entries are handed out as hard links, so evicting one never pulls a
+    # file out from under a job that is still reading it.
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(path: str, etag: str) -> str:
+        return hashlib.sha256(f"{path}\0{etag}".encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        found = []
+        for name in os.listdir(self.root):
+            full = os.path.join(self.root, name)
+            try:
+                st = os.stat(full)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp"):
+                if st.st_mtime < time.time() - STALE_TMP_SECONDS:
+                    try:
+                        os.remove(full)
+                    except FileNotFoundError:
+                        pass
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+
+    def fetch(self, path: str, etag: str, dest: str) -> bool:
+        if not self.enabled:
+            return False
+        key = self.key(path, etag)
+        cached = os.path.join(self.root, key)
+        with self._lock:
+            if key in self._entries:
+                try:
+                    link_or_copy(cached, dest)
+                    os.utime(cached)
+                except FileNotFoundError:
+                    self._bytes -= self._entries.pop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def store(self, path: str, etag: str, src: str) -> None:
+        if not self.enabled:
+            return
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            return
+        key = self.key(path, etag)
+        target = os.path.join(self.root, key)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        link_or_copy(src, tmp)
+        with self._lock:
+            os.replace(tmp, target)
+            if key in self._entries:
+                self._bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(os.path.join(self.root, key))
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,199 @@
+import functools
+import os
+from collections import deque
+from typing import IO, Any, Callable, ContextManager, Dict, Iterable, NamedTuple, Optional
+
+from input_cache import MappedInputs
+from pdf_sequence import PageSequence
+from pdf_writer import PdfAssembler
+from sku_mapping import SkuMapping
+from sku_match import MAX_REPORTED_FUZZY, FuzzySkuIndex
+
+# In-process replacement for the remote PDF organizer processor: fetch the inputs,
+# pair every checklist page with a label page by order number or SKU, and write
+# labels.pdf and checklists.pdf so that page N of one belongs to page N of the other.
+
+# Receives (storage path, local path) pairs and materializes all of them.
+Fetch = Callable[[list[tuple[str, str]]], None]
+# Opens the named output ("labels.pdf", "checklists.pdf") for writing. Leaving the
+# context with an exception must not publish a partial document.
+OpenOutput = Callable[[str], ContextManager[IO[bytes]]]
+
+MAX_REPORTED_UNMATCHED = 20
+
+
+def local_input_paths(paths: list[str], kind: str, work_dir: str) -> list[str]:
+    return [os.path.join(work_dir, f"{kind}-{i}.pdf") for i in range(len(paths))]
+
+
+class MatchResult(NamedTuple):
+    pairs: list[tuple[int, int]]
+    unmatched_checklists: list[int]
+    unmatched_labels: list[int]
+    # (checklist sku, label sku, edit distance) for each pair made by the fuzzy fallback.
+    fuzzy: list[tuple[str, str, int]]
+    # Pairs joined on the order number rather than by SKU.
+    order_matched: int
+
+
+def order_key(order_id: Optional[str]) -> Optional[str]:
+    # The loose "ORDER ..." pattern can pick up a word from a heading; real order
+    # numbers always carry digits.
+    return order_id if order_id and any(c.isdigit() for c in order_id) else None
+
+
+def match_pages(checklist_pages: PageSequence, label_pages: PageSequence, mapping: SkuMapping,
+                fuzzy: bool = True) -> MatchResult:
+    # Order pass: a checklist page and a label page printing the same order number
+    # belong together, whatever their SKUs. SKUs repeat across orders, so they are only
+    # the fallback for pages without a usable order number or whose order has no page
+    # on the other side. Exact SKU pass: one hash join of checklist SKUs (through the
+    # mapping) against the label SKU index, first unused label page wins. Fuzzy pass:
+    # only for checklist pages left over whose SKUs have no label page at all, against
+    # label SKUs with pages still free.
+    by_order: Dict[str, deque[int]] = {}
+    by_sku: Dict[str, deque[int]] = {}
+    for i, page in enumerate(label_pages):
+        order = order_key(page.record.order_id)
+        if order is not None:
+            by_order.setdefault(order, deque()).append(i)
+        for sku in page.record.skus:
+            by_sku.setdefault(sku, deque()).append(i)
+
+    used: set[int] = set()
+    matches: Dict[int, int] = {}
+
+    def take(candidates: Optional[deque[int]]) -> Optional[int]:
+        while candidates and candidates[0] in used:
+            candidates.popleft()
+        if not candidates:
+            return None
+        match = candidates.popleft()
+        used.add(match)
+        return match
+
+    by_order_left: list[int] = []
+    for ci, page in enumerate(checklist_pages):
+        order = order_key(page.record.order_id)
+        match = take(by_order.get(order)) if order is not None else None
+        if match is None:
+            by_order_left.append(ci)
+        else:
+            matches[ci] = match
+    order_matched = len(matches)
+
+    leftover: list[int] = []
+    for ci in by_order_left:
+        skus = checklist_pages[ci].record.skus
+        match = next((m for m in (take(by_sku.get(mapping.lookup(sku))) for sku in skus) if m is not None), None)
+        if match is None:
+            leftover.append(ci)
+        else:
+            matches[ci] = match
+
+    fuzzy_matches: list[tuple[str, str, int]] = []
+    if fuzzy and leftover and len(used) < len(label_pages):
+        index = FuzzySkuIndex(by_sku)
+
+        def has_free_page(sku: str) -> bool:
+            return any(li not in used for li in by_sku[sku])
+
+        for ci in leftover:
+            for sku in map(mapping.lookup, checklist_pages[ci].record.skus):
+                if sku in by_sku:
+                    continue
+                found = index.match(sku, has_free_page)
+                if found is not None:
+                    matches[ci] = take(by_sku[found[0]])
+                    fuzzy_matches.append((sku, found[0], found[1]))
+                    break
+
+    pairs = sorted(matches.items())
+    unmatched_checklists = [ci for ci in leftover if ci not in matches]
+    unmatched_labels = [i for i in range(len(label_pages)) if i not in used]
+    return MatchResult(pairs, unmatched_checklists, unmatched_labels, fuzzy_matches, order_matched)
+
+
+def unmatched_samples(pages: PageSequence, unmatched: list[int]) -> list[Dict[str, Any]]:
+    # Where the first few unmatched pages came from, as (input file, 1-based page).
+    return [{"path": path, "page": page_index + 1}
+            for path, page_index in map(pages.source, unmatched[:MAX_REPORTED_UNMATCHED])]
+
+
+def open_in_dir(work_dir: str, name: str) -> IO[bytes]:
+    return open(os.path.join(work_dir, name), "wb")
+
+
+def write_pages(pages: PageSequence, order: Iterable[int], out: IO[bytes]) -> int:
+    # Returns the number of objects written; shared fonts and images count once.
+    assembler = PdfAssembler(out)
+    for i in order:
+        assembler.add_page(pages.page(i))
+    assembler.close()
+    return assembler.objects_copied
+
+
+def organize(checklist_paths: list[str], labels_paths: list[str], mapping: SkuMapping,
+             fetch: Fetch, work_dir: str, open_output: Optional[OpenOutput] = None,
+             inputs: Optional[MappedInputs] = None) -> Dict[str, Any]:
+    # Without open_output the two documents are written into work_dir and their paths
+    # returned; with it they go wherever it points (e.g. straight into an upload).
+    # Inputs are read through memory maps registered in `inputs`; the caller closes
+    # them, or they are closed here if no MappedInputs was passed.
+    if inputs is None:
+        inputs = MappedInputs()
+        try:
+            return organize(checklist_paths, labels_paths, mapping, fetch, work_dir, open_output, inputs)
+        finally:
+            inputs.close()
+
+    checklist_files = local_input_paths(checklist_paths, "checklist", work_dir)
+    label_files = local_input_paths(labels_paths, "labels", work_dir)
+    fetch(list(zip(checklist_paths + labels_paths, checklist_files + label_files)))
+    checklist_pages = PageSequence.open(checklist_paths, checklist_files, inputs)
+    label_pages = PageSequence.open(labels_paths, label_files, inputs)
+
+    checklist_pages.index(mapping.index.keys())
+    label_pages.index(mapping.label_skus)
+    matched = match_pages(checklist_pages, label_pages, mapping)
+    pairs, unmatched_checklists, unmatched_labels = matched.pairs, matched.unmatched_checklists, matched.unmatched_labels
+    # Indexing left every content stream parsed in the readers' caches; the writer
+    # re-reads them one page at a time.
+    checklist_pages.release_parsed()
+    label_pages.release_parsed()
+
+    out: Dict[str, Any] = {}
+    if open_output is None:
+        out["labelsPath"] = os.path.join(work_dir, "labels.pdf")
+        out["checklistPath"] = os.path.join(work_dir, "checklists.pdf")
+        open_output = functools.partial(open_in_dir, work_dir)
+    with open_output("labels.pdf") as f:
+        label_objects = write_pages(label_pages, [li for _, li in pairs] + unmatched_labels, f)
+    with open_output("checklists.pdf") as f:
+        checklist_objects = write_pages(checklist_pages, [ci for ci, _ in pairs] + unmatched_checklists, f)
+
+    stats: Dict[str, Any] = {
+        "engine": "local",
+        "checklistPages": len(checklist_pages),
+        "labelPages": len(label_pages),
+        "checklistFilePages": checklist_pages.file_page_counts(),
+        "labelFilePages": label_pages.file_page_counts(),
+        "matched": len(pairs),
+        "orderMatched": matched.order_matched,
+        "exactMatched": len(pairs) - matched.order_matched - len(matched.fuzzy),
+        "fuzzyMatched": len(matched.fuzzy),
+        "unmatchedChecklistPages": len(unmatched_checklists),
+        "unmatchedLabelPages": len(unmatched_labels),
+        "mappedInputBytes": inputs.bytes,
+        "labelObjectsCopied": label_objects,
+        "checklistObjectsCopied": checklist_objects,
+        **mapping.stats(),
+    }
+    if unmatched_checklists:
+        stats["unmatchedChecklistSamples"] = unmatched_samples(checklist_pages, unmatched_checklists)
+    if unmatched_labels:
+        stats["unmatchedLabelSamples"] = unmatched_samples(label_pages, unmatched_labels)
+    if matched.fuzzy:
+        stats["fuzzyMatchSamples"] = [{"checklistSku": c, "labelSku": l, "distance": d}
+                                      for c, l, d in matched.fuzzy[:MAX_REPORTED_FUZZY]]
+    return {**out, "stats": stats}
@@ -0,0 +1,64 @@
+from typing import Collection, Iterator, NamedTuple
+
+from pypdf import PageObject, PdfReader
+
+from input_cache import MappedInputs
+from pdf_pages import PageRecord, index_file
+
+# Suppliers split labels (and sometimes checklists) across many PDFs. A PageSequence
+# treats the N files of one kind as a single logical document: position i in the
+# sequence is some page of some file, and every page keeps pointing into its own
+# reader. Nothing is merged or copied; the writer pulls each page from its source
+# file when it is emitted.
+
+
+class PageRef(NamedTuple):
+    file_index: int
+    record: PageRecord
+
+    @property
+    def page_index(self) -> int:
+        return self.record.page_index
+
+
+class PageSequence:
+    def __init__(self, sources: list[str], files: list[str], readers: list[PdfReader]) -> None:
+        self.sources = sources
+        self.files = files
+        self.readers = readers
+        self.refs: list[PageRef] = []
+
+    @classmethod
+    def open(cls, sources: list[str], files: list[str], inputs: MappedInputs) -> "PageSequence":
+        return cls(sources, files, [PdfReader(inputs.open(path)) for path in files])
+
+    def index(self, known: Collection[str]) -> None:
+        self.refs = [PageRef(file_index, record)
+                     for file_index, (path, reader) in enumerate(zip(self.files, self.readers))
+                     for record in index_file(path, reader, known)]
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def __getitem__(self, i: int) -> PageRef:
+        return self.refs[i]
+
+    def __iter__(self) -> Iterator[PageRef]:
+        return iter(self.refs)
+
+    def page(self, i: int) -> PageObject:
+        ref = self.refs[i]
+        return self.readers[ref.file_index].pages[ref.page_index]
+
+    def source(self, i: int) -> tuple[str, int]:
+        # (storage path, page index within that file) of logical page i.
+        ref = self.refs[i]
+        return self.sources[ref.file_index], ref.page_index
+
+    def file_page_counts(self) -> list[int]:
+        return [len(reader.pages) for reader in self.readers]
+
+    def release_parsed(self) -> None:
+        # Drop the readers' parsed-object caches; pages are re-read from the maps on demand.
+        for reader in self.readers:
+            reader.resolved_objects.clear()
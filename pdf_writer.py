@@ -0,0 +1,174 @@
+from collections import deque
+from typing import IO, Any, Optional
+
+from pypdf import PageObject, PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    PdfObject,
+    StreamObject,
+)
+
+# Assembles an output PDF from pages of already-open source documents without
+# re-rendering or re-encoding anything: page dictionaries are rewritten to point at the
+# new page tree, and every object they reach (content streams, fonts, images, ...) is
+# copied once, byte for byte, with its references renumbered. Objects shared by many
+# pages of one source - typically fonts and logos - are written a single time no matter
+# how many of those pages end up in the output.
+#
+# Objects are written the moment they are reached and forgotten right after; only their
+# offsets and new numbers are kept for the xref table. With a pipe as the output the
+# document streams out while it is built, and dropping the sources' parsed-object caches
+# every RELEASE_SOURCE_BYTES keeps memory flat however many pages go in.
+
+HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+CATALOG_NUM = 1
+PAGES_NUM = 2
+# Page-level keys that tie a page to its source document's structure rather than to
+# what is drawn on it.
+DROPPED_PAGE_KEYS = frozenset(("/Parent", "/B", "/StructParents", "/Thumb", "/PieceInfo"))
+PAGE_TREE_TYPES = ("/Page", "/Pages")
+RELEASE_SOURCE_BYTES = 32 * 1024 * 1024
+
+
+class PdfAssembler:
+    def __init__(self, out: IO[bytes]) -> None:
+        self._out = out
+        self._offset = 0
+        self._offsets: dict[int, int] = {}
+        self._numbers: dict[tuple[int, int, int], int] = {}
+        self._pending: deque[tuple[int, PdfObject]] = deque()
+        self._kids: list[int] = []
+        self._next_num = PAGES_NUM + 1
+        self._sources: dict[int, PdfReader] = {}
+        self._since_release = 0
+        self.objects_copied = 0
+        self._write(HEADER)
+
+    def _write(self, data: bytes) -> None:
+        self._out.write(data)
+        self._offset += len(data)
+
+    def _allocate(self) -> int:
+        num = self._next_num
+        self._next_num += 1
+        return num
+
+    def _reference(self, ref: IndirectObject) -> Optional[int]:
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        num = self._numbers.get(key)
+        if num is not None:
+            return num
+        target = ref.get_object()
+        # Links back into the source page tree (annotation /P, /Dest, ...) would drag in
+        # pages that are not part of the output; they become null unless already copied.
+        if isinstance(target, DictionaryObject) and target.get("/Type") in PAGE_TREE_TYPES:
+            return None
+        num = self._allocate()
+        self._numbers[key] = num
+        self._pending.append((num, target))
+        return num
+
+    def _serialize(self, obj: Any, buf: bytearray) -> None:
+        if isinstance(obj, IndirectObject):
+            num = self._reference(obj)
+            buf += b"null" if num is None else b"%d 0 R" % num
+        elif isinstance(obj, DictionaryObject):
+            self._serialize_dict(obj, buf)
+        elif isinstance(obj, ArrayObject):
+            buf += b"["
+            for i, value in enumerate(obj):
+                if i:
+                    buf += b" "
+                self._serialize(value, buf)
+            buf += b"]"
+        elif obj is None:
+            buf += b"null"
+        else:
+            leaf = _LeafBuffer()
+            obj.write_to_stream(leaf)
+            buf += leaf.data
+
+    def _serialize_dict(self, obj: DictionaryObject, buf: bytearray, extra: bytes = b"") -> None:
+        is_stream = isinstance(obj, StreamObject)
+        buf += b"<<"
+        for key, value in obj.items():
+            if is_stream and key == "/Length":
+                continue
+            buf += b"\n"
+            self._serialize(key, buf)
+            buf += b" "
+            self._serialize(value, buf)
+        if is_stream:
+            buf += b"\n/Length %d" % len(obj._data)
+        buf += extra
+        buf += b"\n>>"
+
+    def _write_object(self, num: int, obj: PdfObject, extra: bytes = b"") -> None:
+        buf = bytearray(b"%d 0 obj\n" % num)
+        if isinstance(obj, DictionaryObject):
+            self._serialize_dict(obj, buf, extra)
+        else:
+            self._serialize(obj, buf)
+        if isinstance(obj, StreamObject):
+            buf += b"\nstream\n"
+            buf += obj._data
+            buf += b"\nendstream"
+        buf += b"\nendobj\n"
+        self._offsets[num] = self._offset
+        self._write(bytes(buf))
+        self._since_release += len(buf)
+        self.objects_copied += 1
+
+    def _drain(self) -> None:
+        while self._pending:
+            num, obj = self._pending.popleft()
+            self._write_object(num, obj)
+
+    def add_page(self, page: PageObject) -> None:
+        ref = page.indirect_reference
+        num = self._allocate()
+        if ref is not None:
+            self._numbers[(id(ref.pdf), ref.idnum, ref.generation)] = num
+        copy = DictionaryObject({NameObject(k): v for k, v in page.items() if k not in DROPPED_PAGE_KEYS})
+        self._kids.append(num)
+        self._write_object(num, copy, b"\n/Parent %d 0 R" % PAGES_NUM)
+        self._drain()
+        if isinstance(page.pdf, PdfReader):
+            self._sources[id(page.pdf)] = page.pdf
+        if self._since_release >= RELEASE_SOURCE_BYTES:
+            self.release_sources()
+
+    def release_sources(self) -> None:
+        # Everything already copied is found through self._numbers, so the readers only
+        # need to re-parse objects that are still to come.
+        for reader in self._sources.values():
+            reader.resolved_objects.clear()
+        self._since_release = 0
+
+    def close(self) -> None:
+        kids = b" ".join(b"%d 0 R" % k for k in self._kids)
+        self._offsets[PAGES_NUM] = self._offset
+        self._write(b"%d 0 obj\n<< /Type /Pages /Kids [%s] /Count %d >>\nendobj\n" % (PAGES_NUM, kids, len(self._kids)))
+        self._offsets[CATALOG_NUM] = self._offset
+        self._write(b"%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n" % (CATALOG_NUM, PAGES_NUM))
+
+        size = self._next_num
+        xref_offset = self._offset
+        lines = [b"xref\n0 %d\n0000000000 65535 f \n" % size]
+        for num in range(1, size):
+            offset = self._offsets.get(num)
+            lines.append(b"%010d 00000 n \n" % offset if offset is not None else b"0000000000 65535 f \n")
+        self._write(b"".join(lines))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, CATALOG_NUM, xref_offset))
+
+
+class _LeafBuffer:
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.data += data
+        return len(data)
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class ResultCache:
+    # In-memory LRU from an input fingerprint to the storage paths and stats of the job
+    # that produced those outputs. Bounded by the total size of the referenced outputs;
+    # evicting an entry only forgets it, the objects in storage are left alone.
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, output_paths: Dict[str, str], stats: Dict[str, Any], size: int) -> None:
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            # The producing job's outputs now hold this result, so any older entry that
+            # pointed at the same paths describes content that is gone.
+            self._discard(key)
+            self._discard_outputs(output_paths)
+            self._entries[key] = {"outputPaths": dict(output_paths), "stats": stats, "bytes": size}
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["bytes"]
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def discard_outputs(self, output_paths: Dict[str, str]) -> None:
+        # Forgets every entry whose outputs live at these paths, before they are rewritten.
+        with self._lock:
+            self._discard_outputs(output_paths)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["bytes"]
+
+    def _discard_outputs(self, output_paths: Dict[str, str]) -> None:
+        for key in [k for k, e in self._entries.items() if e["outputPaths"] == output_paths]:
+            self._discard(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
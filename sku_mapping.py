@@ -0,0 +1,192 @@
+import csv
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+MAPPING_CACHE_SIZE = max(1, int(os.environ.get("PDF_ORGANIZER_MAPPING_CACHE_SIZE", "32")))
+MAPPING_STORE_SIZE = max(1, int(os.environ.get("PDF_ORGANIZER_MAPPING_STORE_SIZE", "16")))
+MAX_REPORTED_CONFLICTS = 20
+HEADER_ROW = ("CHECKLIST_SKU", "LABEL_SKU")
+MAPPING_REF_PATTERN = re.compile(r"^([A-Za-z0-9_.\-]+)@([0-9]+)$")
+
+
+def normalize_sku(value: str) -> str:
+    return " ".join(value.split()).upper().strip("._-")
+
+
+class SkuMapping:
+    # Compiled checklist_sku -> label_sku index. The first row for a checklist SKU wins;
+    # exact repeats count as duplicates, differing repeats as conflicts.
+    __slots__ = ("index", "label_skus", "digest", "duplicates", "conflicts", "conflict_samples")
+
+    def __init__(self, index: Dict[str, str], duplicates: int = 0, conflicts: int = 0,
+                 conflict_samples: Optional[list[Dict[str, Any]]] = None) -> None:
+        self.index = index
+        self.label_skus = frozenset(index.values())
+        self.duplicates = duplicates
+        self.conflicts = conflicts
+        self.conflict_samples = conflict_samples or []
+        # Digest of the normalized content, so CSVs that differ only in case,
+        # whitespace or row order fingerprint the same.
+        h = hashlib.sha256()
+        for checklist_sku, label_sku in sorted(index.items()):
+            h.update(f"{checklist_sku}\0{label_sku}\n".encode("utf-8"))
+        self.digest = h.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def lookup(self, sku: str) -> str:
+        return self.index.get(sku, sku)
+
+    def to_csv(self) -> str:
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(("checklist_sku", "label_sku"))
+        writer.writerows(self.index.items())
+        return buf.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "mappingRows": len(self.index),
+            "mappingDuplicates": self.duplicates,
+            "mappingConflicts": self.conflicts,
+        }
+        if self.conflict_samples:
+            out["mappingConflictSamples"] = self.conflict_samples
+        return out
+
+
+def parse_mapping(csv_data: str, base: Optional[SkuMapping] = None) -> SkuMapping:
+    # With a base, the new rows are layered on a copy of its index (base rows still win).
+    index: Dict[str, str] = dict(base.index) if base else {}
+    duplicates = base.duplicates if base else 0
+    conflicts = base.conflicts if base else 0
+    samples: list[Dict[str, Any]] = list(base.conflict_samples) if base else []
+    for line_no, row in enumerate(csv.reader(io.StringIO(csv_data)), start=1):
+        if len(row) < 2:
+            continue
+        checklist_sku, label_sku = normalize_sku(row[0]), normalize_sku(row[1])
+        if not checklist_sku or not label_sku or (checklist_sku, label_sku) == HEADER_ROW:
+            continue
+        label_sku = sys.intern(label_sku)
+        existing = index.get(checklist_sku)
+        if existing is None:
+            index[checklist_sku] = label_sku
+        elif existing == label_sku:
+            duplicates += 1
+        else:
+            conflicts += 1
+            if len(samples) < MAX_REPORTED_CONFLICTS:
+                samples.append({"line": line_no, "checklistSku": checklist_sku, "kept": existing, "ignored": label_sku})
+    return SkuMapping(index, duplicates, conflicts, samples)
+
+
+EMPTY_MAPPING = SkuMapping({})
+_cache: "OrderedDict[str, SkuMapping]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def compile_mapping(csv_data: Optional[str]) -> SkuMapping:
+    # Compiled indexes are cached by a hash of the raw CSV text so jobs that share a
+    # mapping sheet parse it once.
+    if not csv_data or not csv_data.strip():
+        return EMPTY_MAPPING
+    key = hashlib.sha256(csv_data.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        mapping = _cache.get(key)
+        if mapping is not None:
+            _cache.move_to_end(key)
+            return mapping
+    mapping = parse_mapping(csv_data)
+    with _cache_lock:
+        _cache[key] = mapping
+        while len(_cache) > MAPPING_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return mapping
+
+
+def cache_info() -> Dict[str, int]:
+    with _cache_lock:
+        return {"entries": len(_cache), "maxEntries": MAPPING_CACHE_SIZE}
+
+
+# (mapping_id, after_version, up_to_version) -> [(version, csv_data), ...] in version order.
+FetchVersions = Callable[[str, int, int], list[tuple[int, str]]]
+
+
+def parse_mapping_ref(ref: str) -> tuple[str, int]:
+    match = MAPPING_REF_PATTERN.match(ref)
+    if not match:
+        raise ValueError(f"invalid mapping reference {ref!r}, expected mappingId@version")
+    return match.group(1), int(match.group(2))
+
+
+def local_versions(root: str) -> FetchVersions:
+    # Directory store: {root}/{mapping_id}/{version}.csv, each file holding that version's new rows.
+    def fetch(mapping_id: str, after_version: int, up_to_version: int) -> list[tuple[int, str]]:
+        folder = os.path.join(root, mapping_id)
+        if not os.path.isdir(folder):
+            return []
+        found = []
+        for name in os.listdir(folder):
+            stem, ext = os.path.splitext(name)
+            if ext == ".csv" and stem.isdigit() and after_version < int(stem) <= up_to_version:
+                with open(os.path.join(folder, name), encoding="utf-8") as f:
+                    found.append((int(stem), f.read()))
+        return sorted(found)
+    return fetch
+
+
+class MappingStore:
+    # Named, versioned mapping sets referenced by jobs as mappingId@version. Versions are
+    # append-only deltas, so mappingId@N is the rows of versions 1..N. Compiled versions
+    # stay in memory; a newer version is built from the closest loaded one by fetching
+    # and applying only the missing deltas.
+    def __init__(self, fetch_versions: FetchVersions, max_entries: int = MAPPING_STORE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._fetch = fetch_versions
+        self._entries: "OrderedDict[tuple[str, int], SkuMapping]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.incremental_loads = 0
+
+    def get(self, ref: str) -> SkuMapping:
+        mapping_id, version = parse_mapping_ref(ref)
+        with self._lock:
+            mapping = self._entries.get((mapping_id, version))
+            if mapping is not None:
+                self._entries.move_to_end((mapping_id, version))
+                return mapping
+            base_version, base = max(
+                ((v, m) for (mid, v), m in self._entries.items() if mid == mapping_id and v < version),
+                key=lambda item: item[0],
+                default=(0, None),
+            )
+
+        deltas = self._fetch(mapping_id, base_version, version)
+        if not deltas or deltas[-1][0] != version:
+            raise ValueError(f"mapping {ref} not found")
+        mapping = parse_mapping("\n".join(csv_data for _, csv_data in deltas), base)
+
+        with self._lock:
+            self.loads += 1
+            if base is not None:
+                self.incremental_loads += 1
+            self._entries[(mapping_id, version)] = mapping
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return mapping
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": [f"{mid}@{v}" for mid, v in self._entries],
+                "loads": self.loads,
+                "incrementalLoads": self.incremental_loads,
+            }
@@ -0,0 +1,81 @@
+import os
+from collections import Counter
+from typing import Callable, Iterable, Optional
+
+# Fuzzy fallback for SKUs that have no exact match among the label SKUs: candidates
+# come from a trigram index and are confirmed with a banded edit distance, so a
+# lookup costs a few dictionary probes plus at most FUZZY_MAX_CANDIDATES short
+# comparisons instead of a scan over every label SKU.
+
+FUZZY_MAX_DISTANCE = max(0, int(os.environ.get("PDF_ORGANIZER_FUZZY_MAX_DISTANCE", "1")))
+FUZZY_MIN_LENGTH = max(1, int(os.environ.get("PDF_ORGANIZER_FUZZY_MIN_LENGTH", "6")))
+FUZZY_MAX_CANDIDATES = 20
+MAX_REPORTED_FUZZY = 20
+GRAM = 3
+
+
+def grams(value: str) -> set[str]:
+    padded = f"^{value}$"
+    return {padded[i:i + GRAM] for i in range(len(padded) - GRAM + 1)}
+
+
+def bounded_distance(a: str, b: str, limit: int) -> Optional[int]:
+    # Levenshtein distance if it is <= limit, else None. Only the diagonal band of
+    # width 2*limit+1 is computed and rows stop as soon as they all exceed the limit.
+    if abs(len(a) - len(b)) > limit:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    big = limit + 1
+    prev = [j if j <= limit else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [big] * (len(b) + 1)
+        if i <= limit:
+            cur[0] = i
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        for j in range(lo, hi + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost, big)
+        if min(cur[lo - 1:hi + 1]) > limit:
+            return None
+        prev = cur
+    return prev[len(b)] if prev[len(b)] <= limit else None
+
+
+class FuzzySkuIndex:
+    def __init__(self, skus: Iterable[str], max_distance: int = FUZZY_MAX_DISTANCE,
+                 min_length: int = FUZZY_MIN_LENGTH) -> None:
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self._by_gram: dict[str, list[str]] = {}
+        for sku in skus:
+            if len(sku) >= min_length:
+                for g in grams(sku):
+                    self._by_gram.setdefault(g, []).append(sku)
+
+    def candidates(self, sku: str) -> list[str]:
+        # Label SKUs sharing the most trigrams with sku, best first. One edit changes at
+        # most GRAM trigrams, so anything within max_distance shares at least this many.
+        query = grams(sku)
+        shared = Counter(c for g in query for c in self._by_gram.get(g, ()))
+        needed = len(query) - GRAM * self.max_distance
+        return [c for c, n in shared.most_common(FUZZY_MAX_CANDIDATES) if n >= needed]
+
+    def match(self, sku: str, accept: Optional[Callable[[str], bool]] = None) -> Optional[tuple[str, int]]:
+        # Closest accepted label SKU within max_distance. Two different SKUs at the same
+        # best distance are ambiguous and give no match rather than a coin flip.
+        if self.max_distance <= 0 or len(sku) < self.min_length:
+            return None
+        best: Optional[tuple[str, int]] = None
+        tied = False
+        for candidate in self.candidates(sku):
+            distance = bounded_distance(sku, candidate, self.max_distance)
+            if distance is None or (best is not None and distance > best[1]):
+                continue
+            if accept is not None and not accept(candidate):
+                continue
+            if best is not None and distance == best[1]:
+                tied = True
+            else:
+                best, tied = (candidate, distance), False
+        return None if tied else best
@@ -0,0 +1,27 @@
+-- Claims up to p_limit runnable jobs for one worker. Used by `python worker.py`.
+-- FOR UPDATE SKIP LOCKED lets several workers poll concurrently without ever
+-- handing the same row to two of them. Jobs that mark_pdf_organizer_job_retry put
+-- back in the queue stay invisible until their retry_after has passed.
+create or replace function public.claim_pdf_organizer_jobs(p_worker_id text, p_limit integer)
+returns setof public.pdf_organizer_jobs
+language sql
+as $$
+  update public.pdf_organizer_jobs j
+     set status = 'processing',
+         worker_id = p_worker_id,
+         last_heartbeat_at = now()
+   where j.id in (
+     select q.id
+       from public.pdf_organizer_jobs q
+      where q.status = 'queued'
+        and (q.retry_after is null or q.retry_after <= now())
+      order by q.created_at
+      limit greatest(p_limit, 0)
+      for update skip locked
+   )
+  returning j.*;
+$$;
+
+create index if not exists pdf_organizer_jobs_claim_idx
+  on public.pdf_organizer_jobs (created_at)
+  where status = 'queued';
@@ -0,0 +1,15 @@
+-- Named SKU mapping sets referenced by jobs as "mappingId@version".
+-- Versions are append-only: each row holds only the checklist_sku,label_sku rows
+-- that version adds, and mappingId@N is versions 1..N applied in order. Rows that
+-- redefine a checklist SKU from an earlier version are reported as conflicts and
+-- ignored, so publish a new mapping_id to change an existing pairing.
+create table if not exists public.pdf_organizer_sku_mappings (
+  mapping_id text not null,
+  version integer not null check (version > 0),
+  csv_data text not null,
+  created_at timestamptz not null default now(),
+  primary key (mapping_id, version)
+);
+
+alter table public.pdf_organizer_jobs
+  add column if not exists mapping_ref text;
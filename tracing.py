@@ -0,0 +1,84 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# Optional OpenTelemetry tracing. PDF_ORGANIZER_TRACING selects the exporter:
+#   otlp - OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+#   file - one JSON span per line appended to PDF_ORGANIZER_TRACE_FILE
+# Unset, or without the opentelemetry-sdk package installed, every call here is a no-op.
+# The OTLP exporter additionally needs opentelemetry-exporter-otlp-proto-http.
+
+TRACING = os.environ.get("PDF_ORGANIZER_TRACING", "").strip().lower()
+TRACE_FILE = os.environ.get("PDF_ORGANIZER_TRACE_FILE", "pdf-organizer-spans.jsonl")
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "pdf-organizer-worker")
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+except ImportError:
+    trace = None
+    if TRACING:
+        print("[tracing] opentelemetry-sdk is not installed, tracing disabled")
+        TRACING = ""
+
+_tracer: Any = None
+_setup_lock = threading.Lock()
+
+
+if trace is not None:
+    class FileSpanExporter(SpanExporter):
+        def __init__(self, path: str) -> None:
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans) -> "SpanExportResult":
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self) -> None:
+            pass
+
+
+def _exporter() -> Any:
+    if TRACING == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if TRACING == "file":
+        return FileSpanExporter(TRACE_FILE)
+    raise ValueError(f"PDF_ORGANIZER_TRACING must be otlp or file, got {TRACING!r}")
+
+
+def tracer() -> Any:
+    global _tracer
+    if _tracer is not None or not TRACING:
+        return _tracer
+    with _setup_lock:
+        if _tracer is None:
+            provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+            provider.add_span_processor(BatchSpanProcessor(_exporter()))
+            _tracer = provider.get_tracer("pdf-organizer")
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Any]]:
+    # Child of the current span; exceptions leaving the block are recorded on it and
+    # set its status to error.
+    t = tracer()
+    if t is None:
+        yield None
+        return
+    with t.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None}) as s:
+        yield s
+
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    # Adds W3C traceparent/tracestate for the current span to outgoing request headers.
+    if tracer() is not None:
+        propagate.inject(headers)
+    return headers
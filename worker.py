@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# Entry point for running the app without gunicorn: `python worker.py` is pull mode
+# (Procfile `worker`), `python worker.py web` is Flask's development server. Both
+# `python app.py` forms exec this. Deliberately empty at import time: the
+# page-indexing pool in pdf_pages spawns its processes by re-running __main__, and
+# app.py builds the Flask app, thread pools, caches and metrics when imported.
+
+if __name__ == "__main__":
+    import sys
+
+    import app
+
+    if sys.argv[1:2] == ["web"]:
+        app.run_dev_server()
+    else:
+        app.run_queue_consumer()